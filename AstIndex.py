@@ -0,0 +1,105 @@
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+from clang.cindex import Cursor, CursorKind
+
+import profiling
+
+
+class BlockIndex(object):
+    # Interval index over the compound statements of a translation unit. The statements are either nested
+    # or disjoint, so sorting them by their start and keeping their parents is enough to find the blocks
+    # containing a position in O(log n + depth). It's built with a single walk that only goes into function
+    # bodies and skips expressions and declarations
+    def __init__(self, root: Cursor, file_name: str = None):
+        self._starts: List[Tuple[int, int]] = []
+        self._ends: List[Tuple[int, int]] = []
+        self._parents: List[int] = []
+        self._blocks: List[Cursor] = []
+        self._functions: List[Cursor] = []
+        self._declarations: List[List[Cursor]] = []
+        self._declaration_ends: List[List[Tuple[int, int]]] = []
+        # The init statements of the for loops a block is the body of (or is nested in without a block between)
+        self._loop_declarations: List[List[Cursor]] = []
+
+        blocks = []
+        visited = 0
+        for child in root.get_children():
+            visited += 1
+            if child.kind == CursorKind.FUNCTION_DECL and child.is_definition():
+                if file_name is None or (child.location.file and child.location.file.name == file_name):
+                    for body in child.get_children():
+                        if body.kind == CursorKind.COMPOUND_STMT:
+                            start = len(blocks)
+                            visited += self.__walk(body, -1, blocks)
+                            self._functions.extend([child] * (len(blocks) - start))
+        profiling.count('ast.nodes_visited', visited)
+        # The walk is in pre-order, so the blocks are already sorted by their start
+        for block, parent, declarations, loop_declarations in blocks:
+            self._starts.append((block.extent.start.line, block.extent.start.column))
+            self._ends.append((block.extent.end.line, block.extent.end.column))
+            self._parents.append(parent)
+            self._blocks.append(block)
+            self._declarations.append(declarations)
+            self._loop_declarations.append(loop_declarations)
+            self._declaration_ends.append([(d.extent.end.line, d.extent.end.column) for d in declarations])
+
+    @staticmethod
+    def __walk(node: Cursor, parent: int, blocks: list, loop_declarations: List[Cursor] = ()) -> int:
+        # Returns the number of the nodes visited. loop_declarations are the init statements of the for loops
+        # around the node since the innermost block
+        visited = 1
+        if node.kind == CursorKind.COMPOUND_STMT:
+            declarations = []
+            blocks.append((node, parent, declarations, list(loop_declarations)))
+            parent = len(blocks) - 1
+            for child in node.get_children():
+                if child.kind == CursorKind.DECL_STMT:
+                    declarations.append(child)
+                    visited += 1
+                else:
+                    visited += BlockIndex.__walk(child, parent, blocks)
+        elif node.kind == CursorKind.FOR_STMT:
+            children = list(node.get_children())
+            if children and children[0].kind == CursorKind.DECL_STMT:
+                loop_declarations = list(loop_declarations) + [children[0]]
+            for child in children:
+                visited += BlockIndex.__walk(child, parent, blocks, loop_declarations)
+        elif node.kind != CursorKind.DECL_STMT and not node.kind.is_expression():
+            for child in node.get_children():
+                visited += BlockIndex.__walk(child, parent, blocks, loop_declarations)
+        return visited
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def find_blocks(self, line: int, column: int = 0) -> [Cursor]:
+        # Blocks containing the position, from the outermost to the innermost
+        return [self._blocks[i] for i in self.__find_indexes((line, column))]
+
+    def find_declarations(self, line: int, column: int = 0) -> [Cursor]:
+        # Declaration statements completed before the position in the blocks containing it, from the outermost
+        # block to the innermost. The init statement of a for loop comes before the ones of the loop body
+        position = (line, column)
+        declarations = []
+        for i in self.__find_indexes(position):
+            declarations.extend(self._loop_declarations[i])
+            declarations.extend(self._declarations[i][:bisect_right(self._declaration_ends[i], position)])
+        return declarations
+
+    def find_function(self, line: int, column: int = 0) -> Cursor:
+        # The function whose body contains the position, if any
+        indexes = self.__find_indexes((line, column))
+        return self._functions[indexes[0]] if indexes else None
+
+    def __find_indexes(self, position: Tuple[int, int]) -> [int]:
+        # The last block starting before the position either contains it or is nested in the innermost
+        # block containing it
+        i = bisect_left(self._starts, position) - 1
+        while i >= 0 and not self._ends[i] > position:
+            i = self._parents[i]
+        indexes = []
+        while i >= 0:
+            indexes.append(i)
+            i = self._parents[i]
+        return list(reversed(indexes))
@@ -0,0 +1,64 @@
+import re
+from typing import Iterable, List, Union
+
+from Trace import Trace
+
+
+class Breakpoint(object):
+    # A line (counted from 0) with an optional OpenCL C condition the work-items only stop on if it holds,
+    # an optional cap on the number of hits over all the work-items and an optional Trace of the hits of every
+    # work-item (only the first one is printed otherwise)
+    _keywords = {'sizeof', 'signed', 'unsigned', 'const', 'volatile', 'void', 'bool', 'true', 'false', 'half', 'size_t',
+                 'ptrdiff_t', 'intptr_t', 'uintptr_t'}
+    # Member and vector component names follow a '.' or '->', function names are followed by a '('
+    _identifier = re.compile(r'(\.|->)?\s*\b([A-Za-z_]\w*)\b(\s*\()?')
+
+    def __init__(self, line: int, condition: str = None, max_hits: int = None, trace: Union[str, Trace] = None):
+        assert max_hits is None or max_hits > 0
+        self.line = line
+        self.condition = condition.strip() if condition and condition.strip() else None
+        self.max_hits = max_hits
+        self.trace = Trace.make(trace)
+        if self.condition is not None:
+            self.__check_syntax()
+
+    @staticmethod
+    def make(breakpoint: Union[int, 'Breakpoint']) -> 'Breakpoint':
+        return breakpoint if isinstance(breakpoint, Breakpoint) else Breakpoint(breakpoint)
+
+    @staticmethod
+    def make_all(breakpoints: Union[int, 'Breakpoint', Iterable[Union[int, 'Breakpoint']]]) -> List['Breakpoint']:
+        if isinstance(breakpoints, (int, Breakpoint)):
+            return [Breakpoint.make(breakpoints)]
+        return [Breakpoint.make(b) for b in breakpoints]
+
+    def __check_syntax(self):
+        # The condition goes into an if, so it must not be able to close it or the block around it
+        if re.search('[;{}]', self.condition):
+            raise Exception(f'The condition "{self.condition}" must be a single expression')
+        depth = 0
+        for c in self.condition:
+            depth += {'(': 1, ')': -1}.get(c, 0)
+            if depth < 0:
+                break
+        if depth != 0:
+            raise Exception(f'Unbalanced parentheses in the condition "{self.condition}"')
+
+    def get_unknown_names(self, names: Iterable[str]) -> [str]:
+        # The identifiers of the condition that are neither among the names nor keywords, types, functions,
+        # members or macros (which are all in upper case)
+        if self.condition is None:
+            return []
+        # primitives is only imported here, so that the CLI may create breakpoints without loading NumPy
+        from primitives import ClTypes
+        names = set(names) | self._keywords | set(ClTypes.scalar_types) | set(ClTypes.vector_types)
+        unknown = []
+        for member, name, call in self._identifier.findall(self.condition):
+            if member or call or name.isupper() or name in names:
+                continue
+            if name not in unknown:
+                unknown.append(name)
+        return unknown
+
+    def __repr__(self):
+        return f'Breakpoint({self.line!r}, {self.condition!r}, {self.max_hits!r}, {self.trace!r})'
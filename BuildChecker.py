@@ -0,0 +1,85 @@
+import glob
+import os
+import sysconfig
+from logging import warning
+from typing import List, Tuple
+
+import profiling
+from SourceCache import SourceCache
+
+
+class BuildChecker(object):
+    # Compiles the instrumented kernel with libclang in the OpenCL mode before the binary is run, so that the code
+    # inserted into it can't fail the build of the binary. The kernel may need the build options of the binary
+    # (its macros, include paths and so on), so the original kernel is compiled too and only the errors the
+    # instrumentation brings are reported. The results are cached by the hash of the compiled sources
+    _severity_error = 3
+    # Where the OpenCL C header with the built-in functions may be if libclang doesn't come with one
+    _header_dirs = ['/usr/lib/llvm-*/lib/clang/*/include', '/usr/lib/clang/*/include', '/usr/local/lib/clang/*/include',
+                    os.path.join(sysconfig.get_paths()['purelib'], 'pocl_binary_distribution/.libs/share/pocl/include'),
+                    '/usr/share/pocl/include', '/usr/local/share/pocl/include']
+    _header = 'opencl-c.h'
+    # The diagnostics of what's missing without the header
+    _missing_builtins = ['implicit declaration of function', 'use of undeclared identifier', 'unknown type name']
+
+    def __init__(self, cache: SourceCache = None, options: List[str] = (), header_dirs: List[str] = None):
+        # options: the build options of the binary, e.g. ['-D', 'N=16', '-cl-std=CL2.0']
+        self._cache = cache
+        self._options = list(options)
+        self._header_dir = self.__find_header_dir(header_dirs if header_dirs is not None else self._header_dirs)
+
+    @staticmethod
+    def __find_header_dir(patterns: [str]) -> str:
+        for pattern in patterns:
+            for directory in sorted(glob.glob(pattern), reverse=True):
+                if os.path.exists(os.path.join(directory, BuildChecker._header)):
+                    return directory
+        return None
+
+    def get_args(self, cl_std: str = 'CL1.2') -> [str]:
+        args = ['-x', 'cl', '-ferror-limit=0', '-w']
+        if not any(o.startswith('-cl-std=') for o in self._options):
+            args.append(f'-cl-std={cl_std}')
+        if self._header_dir is not None:
+            args += ['-I', self._header_dir, '-include', self._header]
+        return args + self._options
+
+    def check(self, kernel_file: str, source: str, instrumented: str, origins: List[Tuple[int, bool]],
+              cl_std: str = 'CL1.2') -> [str]:
+        # Returns the errors the instrumented kernel has and the source hasn't, as '<file>:<line>: <message>'
+        # with the lines of the source (counted from 1). origins: see PrintfInserter.get_line_origins
+        args = self.get_args(cl_std)
+        path = os.path.abspath(kernel_file)
+        if self._header_dir is None:
+            warning(f'{self._header} was not found, the instrumented kernel is only checked for what doesn\'t '
+                    f'depend on the built-in functions of OpenCL C')
+        known = {(line, message) for line, message in self.__compile(path, source, args)}
+        errors = []
+        for line, message in self.__compile(path, instrumented, args):
+            if self._header_dir is None and any(message.startswith(m) for m in self._missing_builtins):
+                continue
+            origin, inserted = origins[line - 1] if 0 < line <= len(origins) else (line - 1, False)
+            if inserted:
+                errors.append(f'{kernel_file}:{origin + 1}: {message} (in the code inserted before the line)')
+            elif (origin + 1, message) not in known:
+                errors.append(f'{kernel_file}:{origin + 1}: {message}')
+        return errors
+
+    def __compile(self, path: str, source: str, args: [str]) -> [(int, str)]:
+        # The (line, message) of the errors in the source itself
+        key = SourceCache.get_key('build_check', path, source, args, self._header_dir)
+        if self._cache is not None:
+            errors = self._cache.get_output(key)
+            if errors is not None:
+                profiling.count('build_check.cache_hits')
+                return errors
+        with profiling.phase('build_check.compile'):
+            from clang.cindex import Index
+            index = self._cache.get_index() if self._cache is not None else Index.create()
+            translation_unit = index.parse(path, args=args, unsaved_files=[(path, source)])
+            errors = [(d.location.line, d.spelling) for d in translation_unit.diagnostics
+                      if d.severity >= self._severity_error and d.location.file is not None and
+                      d.location.file.name == path]
+        if self._cache is not None:
+            self._cache.put_output(key, errors)
+        return errors
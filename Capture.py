@@ -0,0 +1,262 @@
+import json
+import os
+from typing import Dict, Iterator, List, TextIO, Tuple
+
+import numpy as np
+
+import profiling
+from primitives import Buffer, ClTypes, Summary, ValueDecoder, VarInfo
+
+FORMAT_VERSION = 1
+INDEX_FILE = 'index.json'
+
+
+class CapturedVariable(object):
+    # A variable at a breakpoint for all the threads that hit it: gids is sorted, the rows of addresses (the array
+    # headers) and values follow it. At the traced breakpoints (see Trace), a thread has a row per hit, in the
+    # order of hits, so that its rows are the time series of the variable. If the launches are counted (see
+    # VarInfo.launches), a thread has rows for every launch, in the order of launches, and launches follows them too.
+    # Summaries are kept in a structured array with the Summary.fields, snapshots of buffers of structs in one with
+    # the layout of the struct. values is None for the types that can't be decoded yet
+    __slots__ = ('line', 'info', 'gids', 'addresses', 'values', 'hits', 'launches')
+
+    def __init__(self, line: int, info: VarInfo, gids: np.ndarray, addresses: np.ndarray, values: np.ndarray,
+                 hits: np.ndarray = None, launches: np.ndarray = None):
+        self.line = line
+        self.info = info
+        self.gids = gids
+        self.addresses = addresses
+        self.values = values
+        self.hits = hits
+        self.launches = launches
+
+    @staticmethod
+    def decode(line: int, info: VarInfo, gids: [int], records: list, hits: list = None,
+               launches: list = None) -> 'CapturedVariable':
+        hits = hits if info.trace else None
+        launches = launches if info.launches else None
+        order = CapturedVariable.__get_order(gids, hits, launches)
+        variable = CapturedVariable.__decode(line, info, gids, records, order)
+        if hits is not None:
+            variable.hits = np.asarray(hits, dtype=np.int64)[order]
+        if launches is not None:
+            variable.launches = np.asarray(launches, dtype=np.int64)[order]
+        return variable
+
+    @staticmethod
+    def __get_order(gids: [int], hits: list, launches: list) -> np.ndarray:
+        # By thread, then launch, then hit
+        keys = [np.asarray(k, dtype=np.int64) for k in [hits, launches] if k is not None and len(gids)]
+        gids = np.asarray(gids, dtype=np.int64)
+        if not keys:
+            return np.argsort(gids, kind='stable')
+        return np.lexsort(tuple(keys) + (gids,))
+
+    @staticmethod
+    def __decode(line: int, info: VarInfo, gids: [int], records: list, order: np.ndarray) -> 'CapturedVariable':
+        gids = np.asarray(gids, dtype=np.int64)[order]
+        records = [records[i] for i in order]
+        if info.summary:
+            columns = Summary.decode_columns(info, records)
+            dtype = [(f, ClTypes.parser[t]) for f, t in zip(Summary.fields, Summary.get_types(info))]
+            values = np.empty(len(records), dtype=dtype)
+            for field, column in zip(Summary.fields, columns):
+                values[field] = column
+            return CapturedVariable(line, info, gids, values['address'].astype(np.uint64).reshape(-1, 1), values)
+        if info.snapshot is not None:
+            if not records:
+                return CapturedVariable(line, info, gids, np.empty((0, 1), dtype=np.uint64),
+                                        np.empty((0, info.var_shape[0]), dtype=Buffer.get_dtype(info)))
+            addresses, values = Buffer.decode_all(info, records)
+            return CapturedVariable(line, info, gids, addresses.astype(np.uint64).reshape(-1, 1), values)
+        decoder = ValueDecoder.for_info(info)
+        if not decoder.supported:
+            return CapturedVariable(line, info, gids, np.empty((len(gids), 0), dtype=np.uint64), None)
+        addresses, values = decoder.decode(records)
+        return CapturedVariable(line, info, gids, addresses, values)
+
+    @property
+    def name(self) -> str:
+        return self.info.var_name
+
+    def __len__(self):
+        return len(self.gids)
+
+    def __getitem__(self, gid: int):
+        # The value of the variable for a thread, or its values at every hit (see get_hits) if it's traced and in
+        # every launch (see get_launches) if they're counted
+        i = np.searchsorted(self.gids, gid)
+        if i == len(self.gids) or self.gids[i] != gid:
+            raise KeyError(gid)
+        if self.hits is not None or self.launches is not None:
+            return self.values[i:np.searchsorted(self.gids, gid, side='right')] if self.values is not None else None
+        return self.values[i] if self.values is not None else None
+
+    def get_hits(self, gid: int) -> np.ndarray:
+        i, j = np.searchsorted(self.gids, gid), np.searchsorted(self.gids, gid, side='right')
+        if i == j or self.hits is None:
+            raise KeyError(gid)
+        return self.hits[i:j]
+
+    def get_launches(self, gid: int) -> np.ndarray:
+        i, j = np.searchsorted(self.gids, gid), np.searchsorted(self.gids, gid, side='right')
+        if i == j or self.launches is None:
+            raise KeyError(gid)
+        return self.launches[i:j]
+
+    def __repr__(self):
+        shape = None if self.values is None else self.values.shape
+        return f'CapturedVariable(line={self.line}, name={self.name!r}, threads={len(self)}, shape={shape})'
+
+
+class Capture(object):
+    # The variables of a session in the order of the breakpoints and, within a breakpoint, of the declarations.
+    # Every variable keeps a single VarInfo and a contiguous array per field, so it takes about as much memory
+    # as the values themselves and saves as is (.npz or a directory of .npy files to memory-map)
+    __slots__ = ('variables',)
+
+    def __init__(self, variables: List[CapturedVariable] = None):
+        self.variables = variables if variables is not None else []
+
+    @staticmethod
+    def from_records(info: Dict[int, List[VarInfo]],
+                     records: Dict[int, List[Tuple[list, list, list, list]]]) -> 'Capture':
+        # records: the gids, the record values, the hits and the launches of every variable, see
+        # OclDebugger._read_records
+        with profiling.phase('capture.decode'):
+            return Capture([CapturedVariable.decode(line, i, *variable)
+                            for line in info for i, variable in zip(info[line], records[line])])
+
+    def __iter__(self) -> Iterator[CapturedVariable]:
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+    @property
+    def lines(self) -> [int]:
+        return sorted({v.line for v in self.variables})
+
+    def get(self, line: int, name: str) -> CapturedVariable:
+        # The innermost declaration of the name comes last
+        for v in reversed(self.variables):
+            if v.line == line and v.name == name:
+                return v
+        raise KeyError((line, name))
+
+    def __get_index(self) -> dict:
+        return {
+            'version': FORMAT_VERSION,
+            'variables': [{'line': v.line, 'info': v.info.__dict__, 'decoded': v.values is not None}
+                          for v in self.variables]
+        }
+
+    def __get_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {}
+        for i, v in enumerate(self.variables):
+            arrays[f'v{i}_gids'] = v.gids
+            arrays[f'v{i}_addresses'] = v.addresses
+            if v.hits is not None:
+                arrays[f'v{i}_hits'] = v.hits
+            if v.launches is not None:
+                arrays[f'v{i}_launches'] = v.launches
+            if v.values is not None:
+                arrays[f'v{i}_values'] = v.values
+        return arrays
+
+    @staticmethod
+    def __from_index(index: dict, arrays) -> 'Capture':
+        if index.get('version') != FORMAT_VERSION:
+            raise Exception(f'Unsupported capture format version {index.get("version")}')
+        variables = []
+        for i, v in enumerate(index['variables']):
+            values = arrays(f'v{i}_values') if v['decoded'] else None
+            info = VarInfo.from_dict(v['info'])
+            hits = arrays(f'v{i}_hits') if info.trace else None
+            launches = arrays(f'v{i}_launches') if info.launches else None
+            variables.append(CapturedVariable(v['line'], info, arrays(f'v{i}_gids'), arrays(f'v{i}_addresses'),
+                                              values, hits, launches))
+        return Capture(variables)
+
+    def save(self, path: str):
+        # .npz and .json files, or a directory otherwise
+        if path.endswith('.npz'):
+            self.save_npz(path)
+        elif path.endswith('.json'):
+            with open(path, 'w') as f:
+                self.to_json(f)
+        else:
+            self.save_dir(path)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> 'Capture':
+        if os.path.isdir(path):
+            return Capture.load_dir(path, mmap)
+        return Capture.load_npz(path)
+
+    def save_npz(self, path: str, compressed: bool = False):
+        index = np.array(json.dumps(self.__get_index()))
+        with profiling.phase('capture.save'):
+            (np.savez_compressed if compressed else np.savez)(path, index=index, **self.__get_arrays())
+
+    @staticmethod
+    def load_npz(path: str) -> 'Capture':
+        with np.load(path, allow_pickle=False) as f:
+            return Capture.__from_index(json.loads(str(f['index'])), lambda name: f[name])
+
+    def save_dir(self, path: str):
+        with profiling.phase('capture.save'):
+            os.makedirs(path, exist_ok=True)
+            for name, array in self.__get_arrays().items():
+                np.save(os.path.join(path, f'{name}.npy'), array, allow_pickle=False)
+            # The index goes last, so that a directory with an index is complete
+            with open(os.path.join(path, INDEX_FILE), 'w') as f:
+                json.dump(self.__get_index(), f)
+
+    @staticmethod
+    def load_dir(path: str, mmap: bool = True) -> 'Capture':
+        # With mmap, the arrays are only read from the disk as they are accessed
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        mode = 'r' if mmap else None
+        return Capture.__from_index(index, lambda name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode,
+                                                                allow_pickle=False))
+
+    def to_json(self, f: TextIO):
+        # Writes the capture variable by variable and thread by thread, so the JSON never has to fit into memory
+        f.write(f'{{"version": {FORMAT_VERSION}, "variables": [')
+        for i, v in enumerate(self.variables):
+            f.write(', ' if i else '')
+            f.write(f'{{"line": {v.line}, "info": {json.dumps(v.info.__dict__)}, "threads": [')
+            for j, gid in enumerate(v.gids.tolist()):
+                f.write(', ' if j else '')
+                thread = {'gid': gid, 'addresses': v.addresses[j].tolist(), 'value': self.__to_json(v, j)}
+                if v.launches is not None:
+                    thread['launch'] = int(v.launches[j])
+                if v.hits is not None:
+                    thread['hit'] = int(v.hits[j])
+                f.write(json.dumps(thread))
+            f.write(']}')
+        f.write(']}\n')
+
+    @staticmethod
+    def __to_json(v: CapturedVariable, i: int):
+        if v.values is None:
+            return None
+        if v.info.summary:
+            return dict(zip(Summary.fields, v.values[i].tolist()))
+        if v.values.dtype.names is not None:
+            return Capture.__struct_to_json(v.values[i])
+        return v.values[i].tolist()
+
+    @staticmethod
+    def __struct_to_json(values: np.ndarray):
+        # Structs as objects, tolist() would leave the array fields as arrays in tuples
+        if values.dtype.names is None:
+            return values.tolist()
+        if values.ndim:
+            return [Capture.__struct_to_json(v) for v in values]
+        return {name: Capture.__struct_to_json(values[name]) for name in values.dtype.names}
+
+    def __repr__(self):
+        return f'Capture({self.variables!r})'
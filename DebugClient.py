@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import shlex
+import socket
+import sys
+import tempfile
+from logging import fatal
+from typing import Iterator, List, Tuple, Union
+
+# The client is meant to start in milliseconds, so it must not import anything heavy (NumPy, libclang, asyncio)
+
+
+def default_socket_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f'ocl_debugger_{os.getuid()}.sock')
+
+
+def group_series(variables: List[dict]) -> List[dict]:
+    # The daemon streams a variable per hit of the traced breakpoints, OclDebugger.py prints a series per work-item
+    # (and launch) with its hits and a value per hit, as Variable.decode_series makes them. The series start where
+    # their first hit is. A variable declared twice with the same type has two series, so a hit that's already in
+    # a series goes to the next one
+    grouped = []
+    series = {}
+    for v in variables:
+        if 'hit' not in v:
+            grouped.append(v)
+            continue
+        groups = series.setdefault((json.dumps(v['info'], sort_keys=True), v['gid'], v.get('launch')), [])
+        group = next((g for g in groups if v['hit'] not in g['hits']), None)
+        if group is None:
+            group = {'info': v['info'], 'gid': v['gid']}
+            if 'launch' in v:
+                group['launch'] = v['launch']
+            group.update(hits=[], value=[])
+            groups.append(group)
+            grouped.append(group)
+        group['hits'].append(v['hit'])
+        group['value'].append(v['value'])
+    for groups in series.values():
+        for group in groups:
+            hits, values = zip(*sorted(zip(group['hits'], group['value']), key=lambda e: e[0]))
+            group['hits'], group['value'] = list(hits), list(values)
+    return grouped
+
+
+class DebugClient(object):
+    # Talks newline-delimited JSON-RPC 2.0 to a DebugDaemon over its Unix socket
+    def __init__(self, socket_path: str = None):
+        self._socket_path = socket_path or default_socket_path()
+        self._next_id = 0
+
+    def call(self, method: str, params: dict = None) -> Iterator[dict]:
+        # Yields the notifications the daemon streams for the request, then its response
+        self._next_id += 1
+        request = {'jsonrpc': '2.0', 'id': self._next_id, 'method': method, 'params': params or {}}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(self._socket_path)
+            s.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            with s.makefile('r', encoding='utf-8') as f:
+                for line in f:
+                    message = json.loads(line)
+                    yield message
+                    if message.get('id') == request['id']:
+                        return
+        raise Exception('The daemon closed the connection before responding')
+
+    def debug(self, kernel_file: str, binary: str, break_lines: Union[int, List[int]], threads: list,
+              in_place: bool = False, condition: str = None, max_hits: int = None,
+              summary: List[str] = (), watch: List[str] = None, spill: bool = False, snapshot: List[str] = (),
+              snapshot_gid: int = 0, trace: str = None, build_check: bool = True,
+              build_options: List[str] = (), max_launches: int = None, stop_when_complete: bool = True,
+              kill_after: float = 5.0, timeout: float = None,
+              idle_timeout: float = None) -> Iterator[Tuple[int, dict]]:
+        # Yields (line, variable) pairs as soon as the daemon receives them. Paths are resolved here,
+        # since the daemon may run in another directory
+        params = {
+            'kernel_file': os.path.abspath(kernel_file),
+            'binary': os.path.abspath(binary),
+            'break_lines': [break_lines] if isinstance(break_lines, int) else list(break_lines),
+            'threads': threads,
+            'in_place': in_place,
+            'condition': condition,
+            'max_hits': max_hits,
+            'summary': list(summary),
+            'watch': watch,
+            'spill': spill,
+            'snapshot': list(snapshot),
+            'snapshot_gid': snapshot_gid,
+            'trace': trace,
+            'build_check': build_check,
+            'build_options': list(build_options),
+            'max_launches': max_launches,
+            'stop_when_complete': stop_when_complete,
+            'kill_after': kill_after,
+            'timeout': timeout,
+            'idle_timeout': idle_timeout
+        }
+        for message in self.call('debug', params):
+            if 'error' in message:
+                raise Exception(message['error']['message'])
+            if message.get('method') == 'variable':
+                yield message['params']['line'], message['params']['variable']
+
+    def ping(self) -> bool:
+        try:
+            return all('error' not in m for m in self.call('ping'))
+        except OSError:
+            return False
+
+    def shutdown(self):
+        for _ in self.call('shutdown'):
+            pass
+
+
+def main(argv: [str]):
+    parser = argparse.ArgumentParser(prog='DebugClient.py')
+    parser.add_argument('kernel_file')
+    parser.add_argument('binary')
+    parser.add_argument('breakpoints', type=int, nargs='+')
+    parser.add_argument('--threads', nargs='+', default=['0', '3'],
+                        help='the same selectors as the ones of OclDebugger.py')
+    parser.add_argument('--in-place', action='store_true',
+                        help='instrument the kernel file itself instead of a copy of the binary directory')
+    parser.add_argument('--condition', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--max-hits', type=int, help='the same as the one of OclDebugger.py')
+    parser.add_argument('--trace', metavar='HITS', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--watch', nargs='+', metavar='EXPRESSION', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--summary', nargs='+', default=[], metavar='ARRAY',
+                        help='the same as the one of OclDebugger.py')
+    parser.add_argument('--spill', action='store_true', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--snapshot', nargs='+', default=[], metavar='BUFFER',
+                        help='the same as the one of OclDebugger.py')
+    parser.add_argument('--snapshot-gid', type=int, default=0, metavar='GID',
+                        help='the same as the one of OclDebugger.py')
+    parser.add_argument('--build-options', default='', metavar='OPTIONS', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--no-build-check', action='store_true', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--max-launches', type=int, metavar='N', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--run-to-end', action='store_true', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--kill-after', type=float, default=5.0, metavar='SECONDS',
+                        help='the same as the one of OclDebugger.py')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--idle-timeout', type=float, metavar='SECONDS', help='the same as the one of OclDebugger.py')
+    parser.add_argument('--socket', help='the socket the daemon listens on')
+    args = parser.parse_args(argv)
+
+    client = DebugClient(args.socket)
+    break_lines = [line - 1 for line in args.breakpoints]
+    variables = {line: [] for line in break_lines}
+    try:
+        for line, variable in client.debug(args.kernel_file, args.binary, break_lines,
+                                           [int(t) if t.isdigit() else t for t in args.threads], args.in_place,
+                                           args.condition, args.max_hits, args.summary, args.watch,
+                                           args.spill, args.snapshot, args.snapshot_gid, args.trace,
+                                           not args.no_build_check, shlex.split(args.build_options),
+                                           args.max_launches, not args.run_to_end, args.kill_after, args.timeout,
+                                           args.idle_timeout):
+            variables[line].append(variable)
+    except OSError as e:
+        fatal(f'Could not connect to the daemon: {e}')
+        return -1
+    except Exception as e:
+        fatal(str(e))
+        return -1
+    if not any(variables.values()):
+        fatal('No debugging data received')
+        return -1
+
+    # Print the same as OclDebugger.py does. The variables of a work-item are received in the order it prints
+    # them in, which is the order they're declared in
+    for line in variables:
+        print(f'Line {line + 1}:')
+        for v in sorted(group_series(variables[line]), key=lambda v: (v['gid'], v.get('launch', 0))):
+            print(json.dumps(v))
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from logging import warning
+
+from Breakpoint import Breakpoint
+from DebugClient import default_socket_path
+from OclDebugger import OclDebugger
+from SourceCache import SourceCache
+
+
+class DebugDaemon(object):
+    # Serves debug requests as newline-delimited JSON-RPC 2.0 over a Unix socket or stdio. libclang stays
+    # loaded and the parsed kernels stay in the cache between the requests, which may run concurrently
+    # since every session has its own workspace. The workspaces are set up and the kernels instrumented one
+    # session at a time in a worker thread, so that the event loop keeps serving the other requests meanwhile.
+    # The variables are streamed as 'variable' notifications, the response is sent once the session is over
+    def __init__(self, cache: SourceCache = None):
+        self._cache = cache or SourceCache()
+        self._stopped = None
+        self._connections = set()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def serve_unix(self, socket_path: str = None):
+        socket_path = socket_path or default_socket_path()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.__warm_up()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await self.__close_connections()
+            await server.wait_closed()
+            os.remove(socket_path)
+
+    async def serve_stdio(self):
+        self.__warm_up()
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        connection = asyncio.ensure_future(self._handle_connection(reader, writer))
+        stopped = asyncio.ensure_future(self._stopped.wait())
+        await asyncio.wait([connection, stopped], return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        await self.__close_connections()
+
+    async def __close_connections(self):
+        # The connections (idle ones included) and the requests in flight are cancelled once the daemon stops
+        connections = list(self._connections)
+        for connection in connections:
+            connection.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+
+    def __warm_up(self):
+        # Load libclang and the code that uses it before the first request comes
+        import PrintfInserter
+        import primitives
+        self._cache.get_index()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Requests of a connection are handled concurrently, every message is written in a single line
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        requests = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = asyncio.ensure_future(self._handle_request(line, writer))
+                requests.add(request)
+                request.add_done_callback(requests.discard)
+            if requests:
+                await asyncio.wait(requests)
+        except asyncio.CancelledError:
+            # The daemon is stopping. The connection ends normally, a cancelled one would be logged as an error
+            for request in requests:
+                request.cancel()
+            await asyncio.gather(*requests, return_exceptions=True)
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _handle_request(self, line: bytes, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return await self.__send_error(writer, None, -32700, str(e))
+        request_id = request.get('id')
+        method = getattr(self, f'_rpc_{request.get("method")}', None)
+        if method is None:
+            return await self.__send_error(writer, request_id, -32601, f'Unknown method {request.get("method")}')
+        try:
+            result = await method(request_id, request.get('params', {}), writer)
+        except (Exception, SystemExit) as e:
+            # The debugger exits when something goes wrong, which must not take the daemon down
+            message = f'The session exited with code {e.code}' if isinstance(e, SystemExit) else str(e)
+            warning(message)
+            return await self.__send_error(writer, request_id, -32000, message)
+        await self.__send(writer, {'jsonrpc': '2.0', 'id': request_id, 'result': result})
+        if request.get('method') == 'shutdown':
+            # Only once the response is out, since the connections are closed then
+            self._stopped.set()
+
+    @staticmethod
+    async def __send(writer: asyncio.StreamWriter, message: dict):
+        writer.write((json.dumps(message) + '\n').encode('utf-8'))
+        await writer.drain()
+
+    @staticmethod
+    async def __send_error(writer: asyncio.StreamWriter, request_id, code: int, message: str):
+        await DebugDaemon.__send(writer, {'jsonrpc': '2.0', 'id': request_id,
+                                          'error': {'code': code, 'message': message}})
+
+    async def _rpc_ping(self, request_id, params: dict, writer: asyncio.StreamWriter):
+        return 'pong'
+
+    async def _rpc_shutdown(self, request_id, params: dict, writer: asyncio.StreamWriter):
+        # The daemon stops once the response is sent, see _handle_request
+        return None
+
+    async def _rpc_debug(self, request_id, params: dict, writer: asyncio.StreamWriter):
+        # params: kernel_file, binary, break_lines (counted from 0), threads and optionally in_place, condition,
+        # max_hits, trace, summary, watch, spill, snapshot, snapshot_gid, build_check, build_options, max_launches,
+        # stop_when_complete, kill_after, timeout and idle_timeout
+        debugger = OclDebugger(kernel_file=params['kernel_file'], binary=params['binary'], cache=self._cache,
+                               isolated=not params.get('in_place', False), summary=params.get('summary', []),
+                               watch=params.get('watch'), spill=params.get('spill', False),
+                               snapshot=params.get('snapshot', []), snapshot_gid=params.get('snapshot_gid', 0),
+                               build_check=params.get('build_check', True),
+                               build_options=params.get('build_options', []),
+                               max_launches=params.get('max_launches'),
+                               stop_when_complete=params.get('stop_when_complete', True),
+                               kill_after=params.get('kill_after', 5.0), timeout=params.get('timeout'),
+                               idle_timeout=params.get('idle_timeout'))
+        threads = [int(t) if isinstance(t, str) and t.isdigit() else t for t in params['threads']]
+        breakpoints = [Breakpoint(line, params.get('condition'), params.get('max_hits'), params.get('trace'))
+                       for line in params['break_lines']]
+        count = 0
+        async for line, variable in debugger.stream_debug(breakpoints, threads, self._executor):
+            await self.__send(writer, {'jsonrpc': '2.0', 'method': 'variable', 'params': {
+                'id': request_id, 'line': line, 'variable': json.loads(str(variable))}})
+            count += 1
+        return {'variables': count}
+
+
+def main(argv: [str]):
+    parser = argparse.ArgumentParser(prog='DebugDaemon.py')
+    parser.add_argument('--socket', help=f'the socket to listen on, {default_socket_path()} by default')
+    parser.add_argument('--stdio', action='store_true', help='serve the requests coming to stdin instead')
+    parser.add_argument('--cache-dir', help='keep the instrumented kernels there to reuse them in later sessions')
+    args = parser.parse_args(argv)
+
+    daemon = DebugDaemon(SourceCache(cache_dir=args.cache_dir))
+    try:
+        asyncio.run(daemon.serve_stdio() if args.stdio else daemon.serve_unix(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
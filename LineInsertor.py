@@ -1,18 +1,19 @@
+import profiling
 from SourceProcessor import SourceProcessor
 
 
 class LineInserter(SourceProcessor):
-    _line_insertions: [str] = []
-    _indent: str = ''
-    _insert_line: int = 0
-
     def __init__(self):
         SourceProcessor.__init__(self)
+        # The (line, inserted) of every line of the patched code: the line it comes from or, if it's inserted,
+        # the line it's inserted before
+        self._origins = None
+
+    def _insert_lines(self, line: int, insertion: [str], indent: str = ''):
+        # line is one of the parsed code, see SourceProcessor._get_source_line
+        inserted = self._patches.insert_lines(self._get_source_line(line), insertion, indent)
+        profiling.count('source.lines_inserted', inserted)
 
     def _apply_patches(self):
-        line_insertions = []
-        for line in self._line_insertions:
-            line_insertions.extend([self._indent + e for e in line.split('\n')])
-        lines = self._code.split('\n')
-        lines = lines[:self._insert_line] + line_insertions + lines[self._insert_line:]
-        self._code = '\n'.join(lines[:])
+        SourceProcessor._apply_patches(self)
+        self._origins = self._patches.get_line_origins()
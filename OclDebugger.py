@@ -1,52 +1,178 @@
+import argparse
 import asyncio
+import mmap
 import os
+import shlex
+import signal
 import sys
+import tempfile
+from concurrent.futures import Executor
+from contextlib import contextmanager
 from logging import fatal, warning
 from shutil import copyfile  # TODO: find out whether it works with Windows
 
-from typing import List
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Tuple, Union
 
-from PrintfInserter import PrintfInserter
-from primitives import VarInfo, Variable
+import profiling
+from Breakpoint import Breakpoint
+from SourceCache import SourceCache
+from ThreadSelector import ThreadSelector, make_selector
+from Workspace import Workspace
+
+# NumPy and libclang take most of the startup time, so they are only imported once a session needs them
+if TYPE_CHECKING:
+    from Capture import Capture
+    from primitives import VarInfo, Variable
 
 
 class OclDebugger(object):
-    _break_line: int = None
-    _threads: [int] = None
+    _break_lines: [Breakpoint] = None
+    _threads: Union[ThreadSelector, list] = None
+    # The output of the binary is read in chunks of that many bytes
+    _read_size: int = 1 << 20
 
-    def __init__(self, kernel_file: str, binary: str):
+    def __init__(self, kernel_file: str, binary: str, as_ndarray: bool = False, cache: SourceCache = None,
+                 isolated: bool = True, summary: Iterable[str] = (), watch: Iterable[str] = None,
+                 spill: bool = False, snapshot: Iterable[str] = (), snapshot_gid: int = 0, build_check: bool = True,
+                 build_options: Iterable[str] = (), max_launches: int = None, stop_when_complete: bool = True,
+                 kill_after: float = 5.0, timeout: float = None, idle_timeout: float = None):
+        # snapshot: the __global buffers the work-item with the linear global id snapshot_gid prints at the
+        # breakpoints, e.g. 'out[1024]' or 'in[0:4096:16]', see Snapshot.
+        # If build_check is set, the instrumented kernel is compiled with libclang (and the build_options of the
+        # binary, if it has any) before the binary is run, see BuildChecker.
+        # With max_launches, only the first launches of the kernels with breakpoints print anything.
+        # If stop_when_complete is set, the binary is terminated as soon as everything it can print has been
+        # received: SIGTERM first, then SIGKILL if it hasn't exited within kill_after seconds. The binary is stopped
+        # the same way once it has run for timeout seconds or printed nothing for idle_timeout seconds, and the
+        # session goes on with what has been received by then.
+        # If spill is set, the output of the binary is saved to a temporary file as fast as it comes and only
+        # parsed (memory-mapped) once the binary is done, which suits very large captures
         self._kernel_file = kernel_file
+        self._spill = spill
+        self._as_ndarray = as_ndarray
+        self._summary = list(summary)
+        self._watch = list(watch) if watch is not None else None
+        self._snapshot = list(snapshot)
+        self._snapshot_gid = snapshot_gid
+        self._build_check = build_check
+        self._build_options = list(build_options)
+        self._max_launches = max_launches
+        self._stop_when_complete = stop_when_complete
+        self._kill_after = kill_after
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        self._cache = cache
+        self._isolated = isolated
         self._binary = os.path.basename(binary)
         self._binary_dir = os.path.dirname(binary)
-        # TODO: find out whether it works with Windows
-        self._cmd = f'cd {self._binary_dir} && ./{self._binary}'
+        # Where the instrumented kernel is written and the binary is run during a session
+        self._session_kernel_file = None
+        self._session_dir = None
+
+    def safe_debug(self, break_lines: Union[int, Breakpoint, List[Union[int, Breakpoint]]],
+                   threads: Union[ThreadSelector, list]) -> Dict[int, List['Variable']]:
+        self._break_lines = Breakpoint.make_all(break_lines)
+        self._threads = threads
+
+        with self._session():
+            return self._debug()
 
-    def safe_debug(self, break_line: int, threads: [int]):
-        self._break_line = break_line
+    def capture(self, break_lines: Union[int, Breakpoint, List[Union[int, Breakpoint]]],
+                threads: Union[ThreadSelector, list]) -> 'Capture':
+        # Same as safe_debug, but keeps the values in a columnar Capture rather than a Variable per thread
+        from Capture import Capture
+        self._break_lines = Breakpoint.make_all(break_lines)
         self._threads = threads
 
-        copyfile(self._kernel_file, 'kernel_backup')
+        with self._session():
+            info = self._instrument()
+            records = self._run(self._read_records(info, self.value_generator()))
+        return Capture.from_records(info, records)
+
+    async def stream_debug(self, break_lines: Union[int, Breakpoint, List[Union[int, Breakpoint]]],
+                           threads: Union[ThreadSelector, list],
+                           executor: Executor = None) -> AsyncIterator[Tuple[int, 'Variable']]:
+        # Same as safe_debug, but yields (line, variable) pairs as soon as they are received. The workspace is
+        # set up and the kernel instrumented in the executor (the default one of the loop if there's none), so that
+        # the event loop isn't blocked meanwhile
+        self._break_lines = Breakpoint.make_all(break_lines)
+        self._threads = threads
+
+        loop = asyncio.get_running_loop()
+        session = self._session()
+        await loop.run_in_executor(executor, session.__enter__)
         try:
-            variables = self._debug()
+            info = await loop.run_in_executor(executor, self._instrument)
+            async for line, variable in self.stream_values(info, self.value_generator()):
+                yield line, variable
         finally:
-            copyfile('kernel_backup', self._kernel_file)
-        return variables
+            await loop.run_in_executor(executor, session.__exit__, None, None, None)
 
-    def _debug(self):
-        kernel_processor = PrintfInserter(self._break_line, self._threads)
+    @contextmanager
+    def _session(self):
+        if self._isolated:
+            # The session works on its own copy of the binary directory, the original kernel is never touched
+            with Workspace(self._kernel_file, self._binary_dir) as workspace:
+                self._session_kernel_file = workspace.kernel_file
+                self._session_dir = workspace.binary_dir
+                yield
+            return
+
+        with profiling.phase('debugger.backup'):
+            fd, backup = tempfile.mkstemp(prefix='kernel_backup_')
+            os.close(fd)
+            copyfile(self._kernel_file, backup)
+        self._session_kernel_file = self._kernel_file
+        self._session_dir = self._binary_dir
+        try:
+            yield
+        finally:
+            with profiling.phase('debugger.restore'):
+                copyfile(backup, self._kernel_file)
+                os.remove(backup)
+
+    def _instrument(self) -> Dict[int, List['VarInfo']]:
+        with profiling.phase('debugger.instrument'):
+            return self.__instrument()
+
+    def __instrument(self) -> Dict[int, List['VarInfo']]:
+        with profiling.phase('debugger.import'):
+            from PrintfInserter import PrintfInserter
+        kernel_processor = PrintfInserter(self._break_lines, self._threads, cache=self._cache, summary=self._summary,
+                                          watch=self._watch, snapshots=self._snapshot,
+                                          snapshot_gid=self._snapshot_gid, max_launches=self._max_launches)
         with open(self._kernel_file, 'r') as source_kernel_file:
-            kernel = kernel_processor.process_source(str(source_kernel_file.read()), 'cl')
-        with open(self._kernel_file, 'w') as kernel_file:
+            source = str(source_kernel_file.read())
+        kernel = kernel_processor.process_source(source, 'cl')
+        if self._build_check:
+            self.__check_build(source, kernel, kernel_processor.get_line_origins())
+        with open(self._session_kernel_file, 'w') as kernel_file:
             kernel_file.write(kernel)
             kernel_file.close()
 
-        # TODO: perform the build step somewhere around here
+        return kernel_processor.get_variables()
+
+    def __check_build(self, source: str, kernel: str, origins: List[Tuple[int, bool]]):
+        # Fails before the binary is run if the inserted code doesn't compile
+        from BuildChecker import BuildChecker
+        # The hit and launch counters are program scope variables, which need OpenCL C 2.0
+        counted = self._max_launches is not None or any(b.max_hits is not None for b in self._break_lines)
+        cl_std = 'CL2.0' if counted else 'CL1.2'
+        with profiling.phase('debugger.build_check'):
+            errors = BuildChecker(self._cache, self._build_options).check(self._kernel_file, source, kernel,
+                                                                          origins, cl_std)
+        if errors:
+            raise Exception('The instrumented kernel does not compile:\n' + '\n'.join(errors))
 
-        loop = asyncio.get_event_loop()
+    def _debug(self):
+        info = self._instrument()
+        return self._run(self.process_values(info, self.value_generator()))
+
+    @staticmethod
+    def _run(coroutine):
+        loop = asyncio.new_event_loop()
         try:
-            variables = loop.run_until_complete(self.process_values(kernel_processor.get_variables(),
-                                                                    self.value_generator()))
-            return variables
+            return loop.run_until_complete(coroutine)
         finally:
             # see: https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.loop.shutdown_asyncgens
             loop.run_until_complete(loop.shutdown_asyncgens())
@@ -56,31 +182,168 @@ class OclDebugger(object):
         env = os.environ.copy()
 
         dirs = env['PATH'].split(':')
-        dirs[0] = self._binary_dir
+        dirs[0] = self._session_dir
         path = ':'.join(dirs)
 
         env['PATH'] = path
-        env['PWD'] = self._binary_dir
+        env['PWD'] = self._session_dir
         return env
 
-    async def process_values(self, info: List[VarInfo], values):
-        while True:
-            try:
-                if await values.__anext__() == PrintfInserter.get_magic_string():
-                    break
-            except StopAsyncIteration as e:
-                fatal('No debugging data received')
-                exit(-1)
-        variables = []
-        for t in self._threads:
-            for i in info:
-                v = await values.__anext__()
-                variables.append(Variable(i, v, t))
+    def _get_needed(self, info: Dict[int, List['VarInfo']]) -> Dict[Tuple[int, int], int]:
+        # How many (thread, hit) pairs every variable is printed for at most, if that's known before the binary is
+        # run. Conditions only make the number smaller, so they leave it unknown unless the hits are capped
+        if not self._stop_when_complete:
+            return None
+        breakpoints = {b.line: b for b in self._break_lines}
+        threads = make_selector(self._threads).count()
+        needed = {}
+        for line, variables in info.items():
+            breakpoint = breakpoints[line]
+            launches = self._max_launches or 1
+            n = threads * launches if threads is not None and breakpoint.condition is None else None
+            if n is not None and breakpoint.trace is not None:
+                n *= breakpoint.trace.count
+            if breakpoint.max_hits is not None:
+                # The hits are counted over all the launches
+                n = breakpoint.max_hits if n is None else min(n, breakpoint.max_hits)
+            for i, v in enumerate(variables):
+                # A single work-item prints the snapshots, and only at the first hit of every launch
+                needed[line, i] = launches if v.snapshot is not None else n
+        return needed
+
+    @staticmethod
+    async def _stream_records(info: Dict[int, List['VarInfo']], batches,
+                              needed: Dict[Tuple[int, int], int] = None) \
+            -> AsyncIterator[List[Tuple[int, int, int, int, int, bytes]]]:
+        # Assembles the records of every variable, which may come in any order, and yields
+        # (line, variable index, gid, launch, hit, value) of the variables every batch of lines completes.
+        # Only the first hit of a breakpoint by a thread is saved, unless the breakpoint is traced: the hit is
+        # None otherwise, as is the launch unless the launches are counted (see VarInfo.launches). If needed (see
+        # _get_needed) has a number for every variable, the batches are closed (which stops the binary) as soon as
+        # all of them are complete. The records that don't have the length and the checksum they're printed with
+        # (when the printf buffer of the device overflows) are dropped
+        from PrintfInserter import PrintfInserter
+        from primitives import ClTypes
+        tag = PrintfInserter.get_record_tag().encode('ascii')
+        modulus = ClTypes.checksum_modulus
+        damaged = 0
+        traced = {(line, i) for line, variables in info.items() for i, v in enumerate(variables) if v.trace}
+        launched = any(v.launches is not None for variables in info.values() for v in variables)
+        pending = {}
+        done = set()
+        if needed is not None and any(n is None for n in needed.values()):
+            needed = None
+        remaining = sum(needed.values()) if needed is not None else None
+        async for lines in batches:
+            completed = []
+            for value in lines:
+                if not value.startswith(tag):
+                    continue
+                try:
+                    _, line, gid, index, n, value = value.split(maxsplit=5)
+                    launch, hit = None, None
+                    if launched:
+                        launch, value = value.split(maxsplit=1)
+                        launch = int(launch)
+                    if traced and (int(line), int(index)) in traced:
+                        hit, value = value.split(maxsplit=1)
+                        hit = int(hit)
+                    key = (int(line), int(index), int(gid), launch, hit)
+                    if key in done:
+                        continue
+                    length, checksum, value = value.split(maxsplit=2)
+                    intact = len(value) == int(length) and \
+                        int(value.replace(b' ', b'').replace(b',', b''), 16) % modulus == int(checksum, 16)
+                except ValueError:
+                    intact = False
+                if not intact:
+                    damaged += 1
+                    continue
+                records = pending.setdefault(key, {})
+                records[int(n)] = value
+                if len(records) == info[key[0]][key[1]].n_records:
+                    del pending[key]
+                    done.add(key)
+                    completed.append(key + (b' '.join(records[i] for i in range(len(records))),))
+                    if remaining is not None:
+                        remaining -= 1
+            if completed:
+                yield completed
+            if remaining is not None and remaining <= 0:
+                profiling.count('output.stopped_early')
+                await batches.aclose()
+                return
+        if damaged:
+            warning(f'{damaged} records were truncated or damaged and dropped, the printf buffer of the device may '
+                    f'be too small')
+        if pending:
+            warning(f'{len(pending)} variables were received incompletely')
+
+    async def stream_values(self, info: Dict[int, List['VarInfo']], values) -> AsyncIterator[Tuple[int, 'Variable']]:
+        from primitives import Variable
+        async for completed in self._stream_records(info, values, self._get_needed(info)):
+            with profiling.phase('debugger.decode'):
+                # Every variable is decoded for all the threads of the batch at once. The variables of a thread
+                # are yielded in the order it printed them in, the ones of the traced breakpoints hit by hit
+                records = {}
+                for line, index, gid, launch, hit, value in completed:
+                    records.setdefault((line, index), ([], [], [], []))
+                    records[line, index][0].append(gid)
+                    records[line, index][1].append(value)
+                    records[line, index][2].append(hit)
+                    records[line, index][3].append(launch)
+                variables = [(line, v) for (line, index), (gids, values, hits, launches) in sorted(records.items())
+                             for v in Variable.decode_all(info[line][index], values, gids, self._as_ndarray,
+                                                          hits if info[line][index].trace else None,
+                                                          launches if info[line][index].launches else None)]
+            for line, variable in variables:
+                yield line, variable
+
+    async def _read_records(self, info: Dict[int, List['VarInfo']],
+                            values) -> Dict[int, List[Tuple[list, list, list, list]]]:
+        # The gids, the values, the hits (None unless the breakpoint is traced) and the launches (None unless
+        # they're counted) of every variable of every line
+        records = {line: [([], [], [], []) for _ in i] for line, i in info.items()}
+        with profiling.phase('debugger.read'):
+            async for completed in self._stream_records(info, values, self._get_needed(info)):
+                for line, index, gid, launch, hit, value in completed:
+                    records[line][index][0].append(gid)
+                    records[line][index][1].append(value)
+                    records[line][index][2].append(hit)
+                    records[line][index][3].append(launch)
+        if not any(gids for r in records.values() for gids, _, _, _ in r):
+            fatal('No debugging data received')
+            exit(-1)
+        return records
+
+    async def process_values(self, info: Dict[int, List['VarInfo']], values) -> Dict[int, List['Variable']]:
+        from primitives import Variable
+        records = await self._read_records(info, values)
+
+        variables = {}
+        with profiling.phase('debugger.decode'):
+            for line in info:
+                # Decode every variable for all the threads at once, then order them by thread and launch. The hits
+                # of a traced breakpoint are gathered in a Variable per thread (and launch) with a value per hit
+                decoded = []
+                for i, (gids, values, hits, launches) in zip(info[line], records[line]):
+                    launches = launches if i.launches else None
+                    if i.trace:
+                        decoded.extend(Variable.decode_series(i, values, gids, hits, self._as_ndarray,
+                                                              launches))
+                    else:
+                        decoded.extend(Variable.decode_all(i, values, gids, self._as_ndarray, launches=launches))
+                variables[line] = sorted(decoded, key=lambda v: (v.gid, getattr(v, 'launch', 0)))
         return variables
 
-    async def value_generator(self):
+    async def value_generator(self) -> AsyncIterator[List[bytes]]:
+        # Yields the lines of the output of the binary in batches of as many as a chunk holds
         env = self._build_env()
-        create = asyncio.create_subprocess_shell(self._cmd, env=env,
+        # TODO: find out whether it works with Windows
+        # exec makes the binary the leader of the new process group that's signalled to stop it, so that the
+        # processes it starts (which may hold its output open) are stopped with it
+        cmd = f'cd {shlex.quote(self._session_dir)} && exec ./{shlex.quote(self._binary)}'
+        create = asyncio.create_subprocess_shell(cmd, env=env, start_new_session=True,
                                                  stdin=asyncio.subprocess.PIPE,
                                                  stdout=asyncio.subprocess.PIPE,
                                                  stderr=asyncio.subprocess.STDOUT)
@@ -92,34 +355,206 @@ class OclDebugger(object):
         except Exception as e:
             fatal(f'Could not execute {self._binary}')
 
+        stream = _TimedStream(proc.stdout, self._timeout, self._idle_timeout)
+        try:
+            read = self._read_spilled if self._spill else self._read_batches
+            async for lines in read(stream, self._read_size):
+                profiling.count('output.lines', len(lines))
+                yield lines
+            if not stream.expired:
+                await proc.wait()
+        finally:
+            if proc.returncode is None:
+                await self.__stop(proc)
+
+    async def __stop(self, proc: asyncio.subprocess.Process):
+        with profiling.phase('debugger.stop'):
+            if self._kill_after:
+                self.__signal(proc, signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(proc.wait(), self._kill_after)
+                    return
+                except asyncio.TimeoutError:
+                    warning(f'{self._binary} did not exit within {self._kill_after}s of SIGTERM, killing it')
+            self.__signal(proc, signal.SIGKILL)
+            await proc.wait()
+
+    @staticmethod
+    def __signal(proc: asyncio.subprocess.Process, sig: int):
+        # The whole process group of the binary, see value_generator
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    async def _read_batches(stream: asyncio.StreamReader, size: int) -> AsyncIterator[List[bytes]]:
+        # Lines may be of any length: the chunks are only joined once a line ends
+        parts = []
         while True:
-            line = await proc.stdout.readline()
-            if not line:
+            chunk = await stream.read(size)
+            if not chunk:
                 break
-            line = line.decode('ascii').rstrip()
-            yield line
+            profiling.count('output.bytes', len(chunk))
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                parts.append(chunk)
+                continue
+            parts.append(memoryview(chunk)[:end])
+            yield b''.join(parts).split(b'\n')
+            parts = [memoryview(chunk)[end + 1:]]
+        rest = b''.join(parts)
+        if rest:
+            yield [rest]
+
+    @staticmethod
+    async def _read_spilled(stream: asyncio.StreamReader, size: int) -> AsyncIterator[List[bytes]]:
+        with tempfile.TemporaryFile(prefix='ocl_debugger_output_') as f:
+            while True:
+                chunk = await stream.read(size)
+                if not chunk:
+                    break
+                profiling.count('output.bytes', len(chunk))
+                f.write(chunk)
+            f.flush()
+            end = f.tell()
+            if not end:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as output:
+                start = 0
+                while start < end:
+                    # Batches end with the last line that fits into the chunk, or a longer line
+                    if end - start <= size:
+                        stop = end - 1 if output[end - 1] == ord('\n') else end
+                    else:
+                        stop = output.rfind(b'\n', start, start + size)
+                        stop = output.find(b'\n', start + size) if stop < 0 else stop
+                        stop = end if stop < 0 else stop
+                    yield output[start:stop].split(b'\n')
+                    start = stop + 1
+
+
+class _TimedStream(object):
+    # Reads a stream until it ends, the deadline (timeout seconds from now) passes or nothing has come for
+    # idle_timeout seconds, whichever is first. It ends like the stream would in the latter two cases
+    def __init__(self, stream: asyncio.StreamReader, timeout: float = None, idle_timeout: float = None):
+        self._stream = stream
+        self._idle_timeout = idle_timeout
+        self._deadline = asyncio.get_event_loop().time() + timeout if timeout is not None else None
+        self.expired = False
+
+    async def read(self, size: int) -> bytes:
+        if self.expired:
+            return b''
+        limit, reason = self._idle_timeout, f'printed nothing for {self._idle_timeout}s'
+        if self._deadline is not None:
+            left = max(self._deadline - asyncio.get_event_loop().time(), 0)
+            if limit is None or left < limit:
+                limit, reason = left, 'ran out of time'
+        try:
+            return await asyncio.wait_for(self._stream.read(size), limit)
+        except asyncio.TimeoutError:
+            self.expired = True
+            warning(f'The binary {reason}, stopping it and keeping the values received so far')
+            return b''
 
 
 def main(argv: [str]):
-    if len(argv) > 1:
-        kernel_file = argv[0]
-        binary = argv[1]
-        break_line = int(argv[2]) - 1  # It makes a difference if we count from 0 or 1
-    else:
-        kernel_file = '/home/mikhail/src/GRADUATE_WORK/cl_project/build_release/src/application/kernel.cl'
-        binary = '/home/mikhail/src/GRADUATE_WORK/cl_project/build_release/src/application/app'
-        break_line = 9
+    parser = argparse.ArgumentParser(prog='OclDebugger.py')
+    parser.add_argument('kernel_file')
+    parser.add_argument('binary')
+    parser.add_argument('breakpoints', type=int, nargs='+')
+    parser.add_argument('--threads', nargs='+', default=['0', '3'],
+                        help='global ids, <start>:<stop>[:<step>] ranges, every:<n> or '
+                             '{global,local,group}:<x>[,<y>[,<z>]] selectors')
+    parser.add_argument('--cache-dir', help='keep the instrumented kernels there to reuse them in later sessions')
+    parser.add_argument('--in-place', action='store_true',
+                        help='instrument the kernel file itself instead of a copy of the binary directory')
+    parser.add_argument('--condition', help='an OpenCL C expression over the variables visible at the breakpoints, '
+                                            'only the work-items it holds for stop at them')
+    parser.add_argument('--max-hits', type=int,
+                        help='print that many hits of every breakpoint at most over all the work-items: the first '
+                             'hit of a work-item, or every traced one (needs a kernel built with -cl-std=CL2.0)')
+    parser.add_argument('--trace', metavar='HITS',
+                        help='print the hits of the breakpoints in loops rather than the first one: first:<n>, '
+                             'last:<n> or every:<k>:<n> (every k-th hit, n of them at most) per work-item')
+    parser.add_argument('--watch', nargs='+', metavar='EXPRESSION',
+                        help="only print these variables, array slices and vector components, e.g. 'acc[0:64:4]', "
+                             "'tile[3][:]' or 'v.s0123'")
+    parser.add_argument('--summary', nargs='+', default=[], metavar='ARRAY',
+                        help="print the min, max, sum, mean and non-finite counts of these arrays ('*' for all) "
+                             'instead of their elements')
+    parser.add_argument('--snapshot', nargs='+', default=[], metavar='BUFFER',
+                        help="print these __global buffers once per breakpoint, e.g. 'out[1024]' or 'in[0:4096:16]'")
+    parser.add_argument('--snapshot-gid', type=int, default=0, metavar='GID',
+                        help='the linear global id of the work-item that prints the snapshots')
+    parser.add_argument('--build-options', default='', metavar='OPTIONS',
+                        help="the options the binary builds the kernel with (e.g. '-D N=16 -I include'), for the "
+                             'compile check of the instrumented kernel')
+    parser.add_argument('--no-build-check', action='store_true',
+                        help='run the binary without compiling the instrumented kernel with libclang first')
+    parser.add_argument('--max-launches', type=int, metavar='N',
+                        help='only the first N launches of the kernels with breakpoints print anything')
+    parser.add_argument('--run-to-end', action='store_true',
+                        help='let the executable run to the end rather than stop it once everything the breakpoints '
+                             'can print has been received')
+    parser.add_argument('--kill-after', type=float, default=5.0, metavar='SECONDS',
+                        help='how long the executable has to exit after SIGTERM before it is killed (0 kills it '
+                             'right away)')
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help='stop the executable after that long and keep the values received by then')
+    parser.add_argument('--idle-timeout', type=float, metavar='SECONDS',
+                        help='stop the executable if it prints nothing for that long')
+    parser.add_argument('--spill', action='store_true',
+                        help='save the output of the binary to a temporary file and parse it once the binary is done')
+    parser.add_argument('--output', metavar='PATH',
+                        help='save the values to a .npz or a .json file or to a directory of .npy files (see Capture) '
+                             'instead of printing them')
+    parser.add_argument('--profile', nargs='?', const='', metavar='JSON_FILE',
+                        help='print the time spent in every phase to stderr and optionally save it as JSON')
+    args = parser.parse_args(argv)
 
-    threads = [0, 3]
+    profiler = profiling.enable() if args.profile is not None else None
 
     debugger = OclDebugger(
-        kernel_file=kernel_file,
-        binary=binary
+        kernel_file=args.kernel_file,
+        binary=args.binary,
+        cache=SourceCache(cache_dir=args.cache_dir),
+        isolated=not args.in_place,
+        summary=args.summary,
+        watch=args.watch,
+        spill=args.spill,
+        snapshot=args.snapshot,
+        snapshot_gid=args.snapshot_gid,
+        build_check=not args.no_build_check,
+        build_options=shlex.split(args.build_options),
+        max_launches=args.max_launches,
+        stop_when_complete=not args.run_to_end,
+        kill_after=args.kill_after,
+        timeout=args.timeout,
+        idle_timeout=args.idle_timeout
     )
 
-    variables = debugger.safe_debug(break_line=break_line, threads=threads)
-    for v in variables:
-        print(v)
+    # It makes a difference if we count from 0 or 1
+    breakpoints = [Breakpoint(line - 1, args.condition, args.max_hits, args.trace) for line in args.breakpoints]
+    threads = [int(t) if t.isdigit() else t for t in args.threads]
+    if args.output is not None:
+        with profiling.phase('debugger.session'):
+            capture = debugger.capture(break_lines=breakpoints, threads=threads)
+        capture.save(args.output)
+    else:
+        with profiling.phase('debugger.session'):
+            variables = debugger.safe_debug(break_lines=breakpoints, threads=threads)
+        for line, line_variables in variables.items():
+            print(f'Line {line + 1}:')
+            for v in line_variables:
+                print(v)
+
+    if profiler is not None:
+        print(profiler.to_table(), file=sys.stderr)
+        if args.profile:
+            with open(args.profile, 'w') as f:
+                f.write(profiler.to_json())
 
 
 if __name__ == '__main__':
@@ -1,16 +1,19 @@
+from PatchBuffer import PatchBuffer
+from SourceCache import SourceCache
 from SourceProcessor import SourceProcessor
 from primitives import ClTypes
 
 
 class OclSourceProcessor(SourceProcessor):
-    _shift: int = 0
-    _break_line: int = 0
+    _prelude_name = '__losev_prelude__.h'
 
-    def __init__(self):
-        SourceProcessor.__init__(self)
+    def __init__(self, cache: SourceCache = None):
+        SourceProcessor.__init__(self, cache)
 
-    # For some reason clang doesn't parse u* and vector types so it needs a little help
-    def _prepare(self):
+    # For some reason clang doesn't parse u* and vector types so it needs a little help.
+    # The typedefs go to a header, so that libclang can keep them in a precompiled preamble
+    @staticmethod
+    def _get_prelude() -> [str]:
         line_insertions = []
         # a) u* types
         line_insertions.extend([f'typedef unsigned {t} u{t};' for t in ClTypes.signed_integer_types])
@@ -18,15 +21,13 @@ class OclSourceProcessor(SourceProcessor):
         for t in ClTypes.vector_base:
             for n in ClTypes.vector_len:
                 line_insertions.append(f'typedef {t} {t}{n} __attribute__((ext_vector_type({n})));')
-        # 1. Insert
-        lines = self._code.split('\n')
-        lines = line_insertions + lines[:]
-        self._code = '\n'.join(lines)
-        # 2. Shift
-        self._shift = len(line_insertions)
-        self._break_line += self._shift
+        return line_insertions
+
+    def _get_headers(self) -> [(str, str)]:
+        return [(self._prelude_name, '\n'.join(self._get_prelude()))]
 
-    def _defuse(self):
-        # Shift back
-        lines = self._code.split('\n')
-        self._code = '\n'.join(lines[self._shift:])
+    def _prepare(self):
+        # Only the parsed code includes the prelude, the patches go to the source itself
+        self._parsed = PatchBuffer(self._code)
+        self._parsed.insert_lines(0, [f'#include "{self._prelude_name}"'])
+        self._code = self._parsed.apply()
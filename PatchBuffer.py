@@ -0,0 +1,210 @@
+import re
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from typing import List, Tuple
+
+
+class PatchBuffer(object):
+    # Records insertions and replacements against a text by (line, column) of the text (both counted from 0) and
+    # applies them all in a single pass, as a piece table: the patched text is made of slices of the original one
+    # and of the patches. Once it's applied, the positions in either text map to the ones in the other.
+    # Patches at the same position are applied in the order they are made in, except for the lines inserted past
+    # the last line, which come after everything else at the end of the text and after its end position
+    _newline = re.compile('\n')
+
+    def __init__(self, text: str):
+        self._text = text
+        self._line_starts = self.__get_line_starts(text)
+        # (original start, original end, text, past the last line) of every patch, by offsets in the original text
+        self._patches = []
+        # Set by apply: (original start, original end, output start, output end, past the last line) of every patch,
+        # in the output order
+        self._pieces = None
+        self._starts = None
+        self._outputs = None
+        self._first_tail = None
+        self._output = None
+        self.__output_line_starts = None
+
+    @staticmethod
+    def __get_line_starts(text: str) -> [int]:
+        return [0] + [m.end() for m in PatchBuffer._newline.finditer(text)]
+
+    def get_offset(self, line: int, column: int = 0) -> int:
+        if line >= len(self._line_starts):
+            return len(self._text)
+        return self._line_starts[line] + column
+
+    def insert(self, line: int, column: int, text: str):
+        offset = self.get_offset(line, column)
+        self.__add(offset, offset, text)
+
+    def insert_lines(self, line: int, lines: List[str], indent: str = '') -> int:
+        # Inserts the lines (each of which may span several) before the line, returns how many were inserted
+        lines = [indent + l for e in lines for l in e.split('\n')]
+        if not lines:
+            return 0
+        if line >= len(self._line_starts):
+            # Past the last line, which has no line break to insert after
+            self.__add(len(self._text), len(self._text), ''.join('\n' + l for l in lines), True)
+        else:
+            offset = self._line_starts[line]
+            self.__add(offset, offset, ''.join(l + '\n' for l in lines))
+        return len(lines)
+
+    def replace(self, start: Tuple[int, int], end: Tuple[int, int], text: str):
+        # Replaces what's between the (line, column) positions, end excluded
+        self.__add(self.get_offset(*start), self.get_offset(*end), text)
+
+    def __add(self, start: int, end: int, text: str, tail: bool = False):
+        assert 0 <= start <= end <= len(self._text)
+        self._patches.append((start, end, text, tail))
+        self._pieces = None
+
+    def apply(self) -> str:
+        pieces = []
+        output = []
+        position = 0
+        size = 0
+        # sort is stable, so the patches at the same position stay in the order they were made in
+        self._patches.sort(key=lambda p: (p[0], p[3]))
+        for start, end, text, tail in self._patches:
+            if start < position:
+                raise Exception(f'The patch at {self.get_position(start)} overlaps a replacement before it')
+            output.append(self._text[position:start])
+            size += start - position
+            output.append(text)
+            pieces.append((start, end, size, size + len(text), tail))
+            size += len(text)
+            position = end
+        output.append(self._text[position:])
+        output = ''.join(output)
+        self._pieces = pieces
+        # The lines inserted past the last line all come last, the original end position is before the first of them
+        self._first_tail = next((i for i, p in enumerate(pieces) if p[4]), None)
+        self._starts = [p[0] for p in pieces]
+        self._outputs = [p[2] for p in pieces]
+        self._output = output
+        self.__output_line_starts = None
+        return output
+
+    @property
+    def _output_line_starts(self) -> [int]:
+        # Only the mapping of single positions needs them
+        if self.__output_line_starts is None:
+            self.__output_line_starts = self.__get_line_starts(self._output)
+        return self.__output_line_starts
+
+    def get_position(self, offset: int) -> Tuple[int, int]:
+        line = bisect_right(self._line_starts, offset) - 1
+        return line, offset - self._line_starts[line]
+
+    def to_output(self, line: int, column: int = 0) -> Tuple[int, int]:
+        # Where a position of the original text ends up in the patched one: after whatever is inserted at it
+        # (but before the lines inserted past the last line), or at the start of what replaces it
+        assert self._pieces is not None, 'The patches must be applied first'
+        offset = self.get_offset(line, column)
+        i = bisect_right(self._starts, offset)
+        if i:
+            start, end, output_start, output_end, tail = self._pieces[i - 1]
+            if tail:
+                output_start = self._pieces[self._first_tail][2]
+            offset = output_start if offset < end or tail else output_end + offset - end
+        line = bisect_right(self._output_line_starts, offset) - 1
+        return line, offset - self._output_line_starts[line]
+
+    def to_original(self, line: int, column: int = 0) -> Tuple[int, int, bool]:
+        # The position of the original text a position of the patched one comes from, and whether it's in
+        # a patch (the position is then the one the patch starts at)
+        assert self._pieces is not None, 'The patches must be applied first'
+        if line >= len(self._output_line_starts):
+            return len(self._line_starts), 0, False
+        offset, inserted = self.__to_original(self._output_line_starts[line] + column)
+        return self.get_position(offset) + (inserted,)
+
+    def __to_original(self, offset: int) -> Tuple[int, bool]:
+        i = bisect_right(self._outputs, offset)
+        return self.__from_piece(offset, i - 1)
+
+    def __from_piece(self, offset: int, i: int) -> Tuple[int, bool]:
+        # offset is past the output start of the i-th piece and before the one of the next piece
+        if i < 0:
+            return offset, False
+        start, end, output_start, output_end, tail = self._pieces[i]
+        if tail and offset == output_start and i == self._first_tail:
+            # The end of the original text, which the lines inserted past the last line come after
+            return start, False
+        return (start, True) if offset < output_end else (end + offset - output_end, False)
+
+    def get_line_origins(self) -> List[Tuple[int, bool]]:
+        # The (line, inserted) of every line of the patched text: the line of the original one it starts in or,
+        # if it starts in a patch, the line the patch starts at
+        assert self._pieces is not None, 'The patches must be applied first'
+        # A run of the original text or a patch at a time: the lines that start in a run of the original text are
+        # a range of its lines, the ones that start in a patch all come from the same line
+        starts = self._line_starts
+        origins = []
+        # Whether the next character of the patched text starts a line
+        at_line_start = True
+        position = 0
+        for start, end, text, tail in self._patches + [(len(self._text), len(self._text), '', False)]:
+            if start > position:
+                if at_line_start:
+                    origins.append((bisect_right(starts, position) - 1, False))
+                first, last = bisect_right(starts, position), bisect_left(starts, start)
+                origins.extend(zip(range(first, last), repeat(False)))
+                at_line_start = self._text[start - 1] == '\n'
+            if text:
+                line = bisect_right(starts, start) - 1
+                if tail and at_line_start:
+                    # The text ends with a line break: the empty last line comes before the inserted ones, which
+                    # start with a line break
+                    origins.append((line, False))
+                    at_line_start = False
+                n = text.count('\n', 0, len(text) - 1) + at_line_start
+                origins.extend(repeat((line, True), n))
+                at_line_start = text[-1] == '\n'
+            position = end
+        if at_line_start:
+            # The empty line after the last line break
+            origins.append((len(starts) - 1, False))
+        return origins
+
+
+if __name__ == '__main__':
+    # Checks the patched text and the mapping both ways against lines spliced into a list
+    import random
+
+    buffer = PatchBuffer('a\n')
+    buffer.insert_lines(2, ['X'])
+    assert buffer.apply() == 'a\n\nX'
+    assert buffer.to_output(1) == (1, 0) and buffer.to_original(1) == (1, 0, False)
+    assert buffer.get_line_origins() == [(0, False), (1, False), (1, True)]
+
+    buffer = PatchBuffer('int a;\nint b;')
+    buffer.replace((0, 4), (0, 5), 'x')
+    buffer.insert(1, 0, '  ')
+    assert buffer.apply() == 'int x;\n  int b;'
+    assert buffer.to_output(1, 4) == (1, 6) and buffer.to_original(1, 6) == (1, 4, False)
+    assert buffer.to_original(0, 4) == (0, 4, True) and buffer.to_original(1, 0) == (1, 0, True)
+
+    rng = random.Random(0)
+    for _ in range(1000):
+        lines = [str(i) for i in range(rng.randrange(4))]
+        text = '\n'.join(lines) + ('\n' if rng.random() < 0.5 else '')
+        lines = text.split('\n')
+        buffer = PatchBuffer(text)
+        # The inserted lines before every line, then the ones past the last line
+        spliced = [[] for _ in range(len(lines) + 1)]
+        for j in range(rng.randrange(5)):
+            line = rng.randrange(len(lines) + 2)
+            buffer.insert_lines(line, [f'i{j}'])
+            spliced[min(line, len(lines))].append(f'i{j}')
+        assert buffer.apply().split('\n') == [e for i, l in enumerate(lines) for e in spliced[i] + [l]] + spliced[-1]
+        origins = [e for i in range(len(lines)) for e in [(i, True)] * len(spliced[i]) + [(i, False)]]
+        origins += [(len(lines) - 1, True)] * len(spliced[-1])
+        assert buffer.get_line_origins() == origins
+        for i in range(len(lines)):
+            output = origins.index((i, False))
+            assert buffer.to_output(i) == (output, 0) and buffer.to_original(output) == (i, 0, False)
+    print('OK')
@@ -1,30 +1,94 @@
-from typing import List
+from itertools import takewhile
+from math import prod
+from typing import Dict, Iterable, List, Union
 
 from clang.cindex import Cursor, CursorKind
 
 from LineInsertor import LineInserter
 from OclSourceProcessor import OclSourceProcessor
-from filters import filter_node_list_by_node_kind, filter_node_list_by_start_line
+from AstIndex import BlockIndex
+from Breakpoint import Breakpoint
+import profiling
+from filters import filter_node_list_by_node_kind
 from primitives import VarInfo, ClTypes
+from Snapshot import Snapshot
+from SourceCache import SourceCache
+from ThreadSelector import ThreadSelector, make_selector
+from Watch import Watch
 
 
 class PrintfInserter(OclSourceProcessor, LineInserter):
-    _magic_string: str = '[ debugging output begins ]'
-    _counter_names = ['_losev_' + e for e in ['i', 'j', 'k']]
-    _variables: [VarInfo] = None
+    # Records are printed as '<tag> <line> <gid> <variable index> <record index> <length> <checksum> <values>'. With
+    # max_launches, the launch (counted from 0) comes after the record index, then the hit at the traced breakpoints:
+    # '<tag> <line> <gid> <variable index> <record index> [<launch>] [<hit>] <length> <checksum> <values>'. The tag
+    # has the version of the format: in the 2nd one, the values are their bits in fixed-width hex (components
+    # separated by commas), the length is the one of the values and the checksum the sum of their bytes modulo
+    # ClTypes.checksum_modulus (in hex), so that truncated records are told apart
+    _wire_version = 2
+    _record_tag: str = f'[losev{_wire_version}]'
+    _record_counter = '_losev_r'
+    _counter_name = '_losev_i'
+    _hit_name = '_losev_n'
+    _slot_name = '_losev_s'
+    _loop_kinds = [CursorKind.FOR_STMT, CursorKind.WHILE_STMT, CursorKind.DO_STMT]
+    _exit_kinds = [CursorKind.RETURN_STMT, CursorKind.GOTO_STMT, CursorKind.INDIRECT_GOTO_STMT]
+    # Bumped whenever the printed records or the cached state change, so that no cached kernel printing the old
+    # ones is reused
+    _format_version = 7
+    _variables: Dict[int, List[VarInfo]] = None
 
-    def __init__(self, line: int, threads: [int]):
-        OclSourceProcessor.__init__(self)
+    def __init__(self, lines: Union[int, Breakpoint, List[Union[int, Breakpoint]]],
+                 threads: Union[ThreadSelector, list], chunk_size: int = 16, cache: SourceCache = None,
+                 summary: Iterable[str] = (), watch: Iterable[Union[str, Watch]] = None,
+                 snapshots: Iterable[Union[str, Snapshot]] = (), snapshot_gid: int = 0, max_launches: int = None):
+        # The arrays named in summary ('*' stands for all of them) are reduced on the device instead of being dumped.
+        # If there's a watch list, only what it names is printed, in its order, rather than all the visible variables.
+        # The snapshots of __global buffers are printed by the work-item with the linear global id snapshot_gid only.
+        # With max_launches, only the first launches of the kernels print anything
+        assert chunk_size > 0
+        assert max_launches is None or max_launches > 0
         LineInserter.__init__(self)
-        self._break_line = line
-        self._threads = threads
+        OclSourceProcessor.__init__(self, cache)
+        self._breakpoints = Breakpoint.make_all(lines)
+        self._lines = [b.line for b in self._breakpoints]
+        self._break_lines = self._lines.copy()
+        self._chunk_size = chunk_size
+        self._summary = sorted(set(summary))
+        self._watches = Watch.make_all(watch) if watch is not None else None
+        self._snapshots = Snapshot.make_all(snapshots)
+        self._snapshot_gid = snapshot_gid
+        self._max_launches = max_launches
+        self._launch_condition = ''
+        # The thread selection is checked in constant time, its tables (if any) go to the program scope
+        self._selector_declarations = []
+        self._condition = make_selector(threads).compile(self._selector_declarations)
 
-    def get_variables(self):
-        return self._variables.copy()
+    def get_variables(self) -> Dict[int, List[VarInfo]]:
+        return {line: v.copy() for line, v in self._variables.items()}
+
+    def get_line_origins(self) -> [(int, bool)]:
+        # The line of the source (counted from 0) every line of the processed one comes from, and whether
+        # it's inserted before it
+        return self._origins
+
+    def _get_cache_key(self):
+        return self._format_version, self._breakpoints, self._chunk_size, self._summary, self._watches, \
+            self._snapshots, self._snapshot_gid, self._max_launches, self._condition, self._selector_declarations
+
+    def _get_state(self):
+        return self._variables, self._origins
+
+    def _set_state(self, state):
+        self._variables, self._origins = state
+
+    def _prepare(self):
+        OclSourceProcessor._prepare(self)
+        # The breakpoints are at lines of the source, the AST has the ones of the parsed code
+        self._break_lines = [self._get_parsed_line(line) for line in self._lines]
 
     @staticmethod
-    def get_magic_string():
-        return PrintfInserter._magic_string
+    def get_record_tag():
+        return PrintfInserter._record_tag
 
     @staticmethod
     def get_var_declarations(block: Cursor):
@@ -49,119 +113,502 @@ class PrintfInserter(OclSourceProcessor, LineInserter):
             var_declarations.extend(filter_node_list_by_node_kind(d.get_children(), [CursorKind.VAR_DECL]))
         return var_declarations
 
-    def _find_blocks(self, node: Cursor) -> [Cursor]:
-        blocks = []
-        if node.kind == CursorKind.COMPOUND_STMT:
-            if node.extent.start.line <= self._break_line <= node.extent.end.line:
-                blocks.append(node)
-        for child in node.get_children():
-            blocks.extend(self._find_blocks(child))
-        return blocks
+    def _get_block_index(self) -> BlockIndex:
+        return self._get_ast_data('block_index', lambda: BlockIndex(self._ast_root, self._filename))
+
+    def _find_blocks(self, line: int) -> [Cursor]:
+        # The code is inserted before the line, which is counted from 0 unlike the lines of clang
+        return self._get_block_index().find_blocks(line + 1)
 
     @staticmethod
-    def __gen_print_arr(counter_name, count, contents: [str]):
-        lines = [f'{counter_name} = 0;', f'while ({counter_name} < {count}) {{'] \
-                + ['\t' + i for i in contents] + [f'\t{counter_name}++;', f'}}']
+    def __printf(tag: (str, [str]), fields: [(str, str)]) -> str:
+        # Every call prints a whole record, so that the output of different work-items may interleave.
+        # fields: the (type, expression) of the values, pointers are cast to ClTypes.pointer_type by the callers.
+        # Every value is read once into a volatile temporary the checksum and the printed bits are both taken from:
+        # the reads of a value that's not initialized yet could be folded to different bits otherwise
+        profiling.count('source.printf_calls')
+        values = [f'_losev_v{k}' for k in range(len(fields))]
+        temporaries = ''.join(f'volatile {t} {v} = {e}; ' for (t, e), v in zip(fields, values))
+        fmt = ''.join(' ' + ClTypes.get_printf_flag(t) for t, _ in fields)
+        length = sum(ClTypes.get_printed_length(t) for t, _ in fields) + len(fields) - 1
+        terms = [term for (t, _), v in zip(fields, values) for term in ClTypes.get_checksum_terms(t, v)]
+        checksum = f'(uint)(({" + ".join(terms)}) % {ClTypes.checksum_modulus})'
+        args = tag[1] + [checksum] + [ClTypes.get_printf_arg(t, v) for (t, _), v in zip(fields, values)]
+        return f'{{ {temporaries}printf("{tag[0]} {length} %02x{fmt}\\n"{"".join(", " + a for a in args)}); }}'
+
+    def __count_records(self, count: int, chunk: int = None) -> int:
+        chunk = chunk or self._chunk_size
+        if count <= chunk:
+            return 1
+        return 1 + count // chunk + bool(count % chunk)
+
+    @staticmethod
+    def __get_dimensions(v: VarInfo) -> (str, [[int]]):
+        # Splits the subscripts of a (watched) array into the expression of the sub-array it's printed from and
+        # the length, the offset of the first index and the step of every printed dimension. The offsets and
+        # the steps are counted in declared elements from the start of the sub-array
+        declared_shape = v.get_declared_shape()
+        slices = v.slices if v.slices is not None else [[0, n, 1] for n in declared_shape]
+        base = v.var_name
+        dimensions = []
+        for j, s in enumerate(slices):
+            stride = prod(declared_shape[j + 1:])
+            if isinstance(s, int):
+                if dimensions:
+                    dimensions[-1][1] += s * stride
+                else:
+                    base += f'[{s}]'
+            else:
+                dimensions.append([len(range(*s)), s[0] * stride, s[2] * stride])
+        return base, dimensions
+
+    @staticmethod
+    def __make_offset(dimensions: [[int]]):
+        # Returns the function of the flat (row-major) index among the printed elements that gives their offset
+        origin = sum(first for _, first, _ in dimensions)
+        sizes = [prod(n for n, _, _ in dimensions[d + 1:]) for d in range(len(dimensions))]
+        contiguous = all(step == size for (_, _, step), size in zip(dimensions, sizes))
+
+        def offset(index: Union[int, str]) -> str:
+            if isinstance(index, int):
+                return str(origin + sum(index // size % n * step for (n, _, step), size in zip(dimensions, sizes)))
+            index = f'({index})' if ' ' in index else index
+            terms = [str(origin)] if origin else []
+            if contiguous:
+                return ' + '.join(terms + [index])
+            for d, ((n, _, step), size) in enumerate(zip(dimensions, sizes)):
+                if n == 1:
+                    continue
+                term = f'{index} / {size}' if size > 1 else index
+                term = f'{term} % {n}' if d else term
+                terms.append(f'{term} * {step}' if step != 1 else term)
+            return ' + '.join(terms) if terms else '0'
+
+        return offset
+
+    def __gen_print_elements(self, tag: (str, [str]), element, count: int, head: [(str, str)],
+                             chunk: int = None) -> [str]:
+        # printf calls are expensive, so the elements are printed in chunks with an unrolled format string.
+        # element(k) gives the (type, expression) fields of the k-th element. The head is printed within the same
+        # call if the elements fit in a chunk
+        chunk = chunk or self._chunk_size
+        counter_name = self._counter_name
+        if count <= chunk:
+            return [self.__printf(tag, head + [f for k in range(count) for f in element(k)])]
+        lines = [self.__printf(tag, head)]
+        full = count - count % chunk
+        elements = element(counter_name) + [f for k in range(1, chunk) for f in element(f'{counter_name} + {k}')]
+        lines += [f'{counter_name} = 0;', f'while ({counter_name} < {full}) {{',
+                  '\t' + self.__printf(tag, elements),
+                  f'\t{counter_name} += {chunk};', '}']
+        if count % chunk:
+            lines.append(self.__printf(tag, [f for k in range(count % chunk) for f in element(full + k)]))
         return lines
 
-    def generate_printf(self, v: VarInfo) -> str:
-        retval = ''
+    @staticmethod
+    def __pointer(expression: str) -> (str, str):
+        # Pointers are printed as the low bits of their address
+        return ClTypes.pointer_type, f'({ClTypes.pointer_type})(size_t){expression}'
+
+    def generate_printf(self, v: VarInfo, tag: (str, [str]) = ('', [])) -> str:
+        # The tag is the format and the arguments every record of the variable starts with.
+        # The number of records the variable is printed in is saved to v.n_records
+        suffix = f'.{v.components}' if v.components else ''
         if v.is_array:
-            n_dims = len(v.var_shape)
-            counter_names = self._counter_names
-            if 1 == n_dims:
-                retval += f'printf("{ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name});\n'
-                res = self.__gen_print_arr(counter_names[0], str(v.var_shape[0]),
-                                           contents=['printf(" ");',
-                                                     f'printf("{ClTypes.get_printf_flag(v.var_type)}", {v.var_name}[{counter_names[0]}]);'])
-                for e in res:
-                    retval += e + '\n'
-                retval += 'printf("\\n");\n'
-            elif 2 == n_dims:
-                retval += f'printf("{ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name});\n'
-                inner_lines = self.__gen_print_arr(counter_name=counter_names[1], count=str(v.var_shape[1]),
-                                                   contents=['printf(" ");',
-                                                             f'printf("{ClTypes.get_printf_flag(v.var_type)}", {v.var_name}[{counter_names[0]}][{counter_names[1]}]);'])
-                res = self.__gen_print_arr(counter_name=counter_names[0], count=str(v.var_shape[0]),
-                                           contents=[f'printf(" {ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name}[{counter_names[0]}]);'] + inner_lines)
-                for e in res:
-                    retval += e + '\n'
-                retval += 'printf("\\n");'
-            elif 3 == n_dims:
-                retval += f'printf("{ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name});\n'
-                inner_lines = self.__gen_print_arr(counter_name=counter_names[2], count=str(v.var_shape[2]),
-                                                   contents=['printf(" ");',
-                                                             f'printf("{ClTypes.get_printf_flag(v.var_type)}", {v.var_name}[{counter_names[0]}][{counter_names[1]}][{counter_names[2]}]);'])
-                inner_lines = self.__gen_print_arr(counter_name=counter_names[1], count=str(v.var_shape[1]),
-                                                   contents=[f'printf(" {ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name}[{counter_names[0]}][{counter_names[1]}]);'] + inner_lines)
-                res = self.__gen_print_arr(counter_name=counter_names[0], count=str(v.var_shape[0]),
-                                           contents=[f'printf(" {ClTypes.get_printf_flag(ClTypes.pointer_type)}", {v.var_name}[{counter_names[0]}]);'] + inner_lines)
-                for e in res:
-                    retval += e + '\n'
-                retval += 'printf("\\n");'
-            else:
-                raise Exception('Too much array dimensions...')
+            # Arrays of any rank are printed in a single loop over the flattened elements, addressed through
+            # a pointer to the declared element type. Only the address of the array is printed, the addresses
+            # of its sub-arrays follow from v.dimension_offsets (in bytes), see primitives.ValueDecoder
+            base, dimensions = self.__get_dimensions(v)
+            element_type = v.get_declared_type()
+            size = ClTypes.get_size(element_type)
+            pointer = f'(({v.address_space} {element_type} *){base})'
+            count = prod(v.var_shape)
+            offset = self.__make_offset(dimensions)
+            lines = self.__gen_print_elements(tag, lambda k: [(v.var_type, f'{pointer}[{offset(k)}]{suffix}')], count,
+                                              head=[self.__pointer(base)])
+            v.dimension_offsets = [[first * size, step * size] for _, first, step in dimensions]
+            v.n_records = self.__count_records(count)
+            return '\n'.join(lines) + '\n'
         else:
+            v.n_records = 1
+            base = v.var_name + ''.join(f'[{s}]' for s in v.slices or [])
             if v.pointer_rank:
-                retval = f'printf("{ClTypes.get_printf_flag(ClTypes.pointer_type)}\\n", {v.var_name});\n'
+                return self.__printf(tag, [self.__pointer(base)]) + '\n'
             else:
                 # Both scalar and vector
-                retval = f'printf("{ClTypes.get_printf_flag(v.var_type)}\\n", {v.var_name});\n'
-        return retval
+                return self.__printf(tag, [(v.var_type, base + suffix)]) + '\n'
+
+    def generate_snapshot(self, v: VarInfo, tag: (str, [str]) = ('', [])) -> str:
+        # Prints the address of the buffer followed by the sampled elements. The elements of structs are printed
+        # field by field (see v.leaves), in fewer elements per call
+        start, _, step = v.snapshot
+        count = v.var_shape[0]
+
+        def index(k: Union[int, str]) -> str:
+            if isinstance(k, int):
+                return str(start + k * step)
+            k = f'({k})' if ' ' in k and step != 1 else k
+            k = f'{k} * {step}' if step != 1 else k
+            return f'{start} + {k}' if start else k
+
+        if v.leaves is None:
+            chunk = self._chunk_size
+
+            def element(k):
+                return [(v.var_type, f'{v.var_name}[{index(k)}]')]
+        else:
+            chunk = max(1, self._chunk_size // len(v.leaves))
+
+            def element(k):
+                item = f'{v.var_name}[{index(k)}]'
+                return [(t, item + ''.join(f'.{p}' if isinstance(p, str) else f'[{p}]' for p in path))
+                        for path, t in v.leaves]
+
+        lines = self.__gen_print_elements(tag, element, count, head=[self.__pointer(v.var_name)], chunk=chunk)
+        v.n_records = self.__count_records(count, chunk)
+        return '\n'.join(lines) + '\n'
+
+    def generate_ring(self, v: VarInfo, ring: str, size: int, tag: (str, [str]) = ('', [])) -> ([str], str, str):
+        # Returns the declaration of a ring of size copies of what generate_printf prints of the variable, the code
+        # that copies it to the slot _losev_s of the ring and the code that prints the slot in the same records.
+        # Arrays keep their address in a ring of their own
+        slot = self._slot_name
+        suffix = f'.{v.components}' if v.components else ''
+        if v.is_array:
+            base, dimensions = self.__get_dimensions(v)
+            pointer = f'(({v.address_space} {v.get_declared_type()} *){base})'
+            count = prod(v.var_shape)
+            offset = self.__make_offset(dimensions)
+            counter_name = self._counter_name
+            declarations = [f'{ClTypes.pointer_type} {ring}_a[{size}];', f'{v.var_type} {ring}[{size}][{count}];']
+            store = [f'{ring}_a[{slot}] = ({ClTypes.pointer_type})(size_t){base};',
+                     f'{counter_name} = 0;',
+                     f'while ({counter_name} < {count}) {{',
+                     f'\t{ring}[{slot}][{counter_name}] = {pointer}[{offset(counter_name)}]{suffix};',
+                     f'\t{counter_name}++;',
+                     '}']
+            lines = self.__gen_print_elements(tag, lambda k: [(v.var_type, f'{ring}[{slot}][{k}]')], count,
+                                              head=[(ClTypes.pointer_type, f'{ring}_a[{slot}]')])
+            size = ClTypes.get_size(v.get_declared_type())
+            v.dimension_offsets = [[first * size, step * size] for _, first, step in dimensions]
+            v.n_records = self.__count_records(count)
+            return declarations, '\n'.join(store) + '\n', '\n'.join(lines) + '\n'
+        v.n_records = 1
+        base = v.var_name + ''.join(f'[{s}]' for s in v.slices or [])
+        if v.pointer_rank:
+            declarations = [f'{ClTypes.pointer_type} {ring}[{size}];']
+            store = f'{ring}[{slot}] = ({ClTypes.pointer_type})(size_t){base};\n'
+            var_type = ClTypes.pointer_type
+        else:
+            declarations = [f'{v.var_type} {ring}[{size}];']
+            store = f'{ring}[{slot}] = {base}{suffix};\n'
+            var_type = v.var_type
+        return declarations, store, self.__printf(tag, [(var_type, f'{ring}[{slot}]')]) + '\n'
+
+    def generate_summary(self, v: VarInfo, tag: (str, [str]) = ('', [])) -> str:
+        # Reduces the array (all the components of its elements, if they're vectors) and prints a single record:
+        # '<address> <min> <max> <sum> <count> <NaN count> <Inf count> <first non-finite index>', where the first
+        # four only take the finite elements into account, see primitives.Summary
+        assert v.is_array
+        base_type = ClTypes.get_base_type(v.var_type)
+        sum_type = ClTypes.get_sum_type(base_type)
+        count = prod(v.var_shape) * ClTypes.get_vector_len(v.var_type)
+        counter_name = self._counter_name
+        element = f'(({v.address_space} {base_type} *){v.var_name})[{counter_name}]'
+        names = ['_losev_min', '_losev_max', '_losev_sum', '_losev_count', '_losev_nan', '_losev_inf', '_losev_first']
+        lines = ['{']
+        if base_type in ClTypes.float_types:
+            lines += [f'\t{base_type} _losev_min = INFINITY, _losev_max = -INFINITY;',
+                      f'\t{sum_type} _losev_sum = 0;',
+                      '\tint _losev_count = 0, _losev_nan = 0, _losev_inf = 0, _losev_first = -1;',
+                      f'\t{counter_name} = 0;',
+                      f'\twhile ({counter_name} < {count}) {{',
+                      f'\t\t{base_type} _losev_e = {element};',
+                      '\t\tif (isfinite(_losev_e)) {',
+                      '\t\t\t_losev_min = fmin(_losev_min, _losev_e);',
+                      '\t\t\t_losev_max = fmax(_losev_max, _losev_e);',
+                      '\t\t\t_losev_sum += _losev_e;',
+                      '\t\t\t_losev_count++;',
+                      '\t\t} else {',
+                      '\t\t\tif (isnan(_losev_e)) _losev_nan++; else _losev_inf++;',
+                      f'\t\t\tif (_losev_first < 0) _losev_first = {counter_name};',
+                      '\t\t}',
+                      f'\t\t{counter_name}++;',
+                      '\t}']
+        else:
+            # Integers are always finite
+            element_0 = element.replace(f'[{counter_name}]', '[0]')
+            lines += [f'\t{base_type} _losev_min = {element_0}, _losev_max = {element_0};',
+                      f'\t{sum_type} _losev_sum = 0;',
+                      f'\tint _losev_count = {count}, _losev_nan = 0, _losev_inf = 0, _losev_first = -1;',
+                      f'\t{counter_name} = 0;',
+                      f'\twhile ({counter_name} < {count}) {{',
+                      f'\t\t_losev_min = min(_losev_min, {element});',
+                      f'\t\t_losev_max = max(_losev_max, {element});',
+                      f'\t\t_losev_sum += {element};',
+                      f'\t\t{counter_name}++;',
+                      '\t}']
+        fields = [self.__pointer(v.var_name)] + list(zip([base_type, base_type, sum_type] + ['int'] * 4, names))
+        lines += ['\t' + self.__printf(tag, fields), '}']
+        v.summary = True
+        v.n_records = 1
+        return '\n'.join(lines) + '\n'
+
+    def _get_indent(self, line: int) -> str:
+        # Take the indent of the line the code is inserted before (or after, if it closes the block)
+        if line >= len(self._code_lines):
+            return ''
+        code_line = self._code_lines[line]
+        if code_line.strip().startswith('}') and line > 0:
+            code_line = self._code_lines[line - 1]
+        return code_line[:len(code_line) - len(code_line.lstrip())]
 
     def _process(self, node):
         self._code_lines = self._code.split('\n')
+        self._variables = {}
+        self._visible_names = set()
+        declarations = self._selector_declarations.copy()
+        if self._max_launches is not None:
+            self.__count_launches(declarations)
+        for i, (breakpoint, break_line) in enumerate(zip(self._breakpoints, self._break_lines)):
+            guard = self._condition + self._launch_condition
+            if breakpoint.trace is not None and not breakpoint.trace.is_ring:
+                # Only the hits to print take a place among the traced ones
+                taken = f'_losev_taken_{i} < {breakpoint.trace.count}'
+                step = breakpoint.trace.step
+                guard += f' && {self._hit_name} % {step} == 0 && {taken}' if step > 1 else f' && {taken}'
+            if breakpoint.condition is not None:
+                guard += f' && ({breakpoint.condition})'
+            if breakpoint.max_hits is not None:
+                # Only the hits that print count: the first one of every work-item unless the breakpoint is traced
+                # (the later ones wouldn't be read). Work-items check the counter before incrementing it, so it stops
+                # growing once the cap is reached
+                if breakpoint.trace is None:
+                    guard += f' && !_losev_printed_{i}'
+                counter = f'_losev_hits_{i}'
+                declarations.append(f'volatile __global int {counter} = 0;')
+                guard += f' && {counter} < {breakpoint.max_hits} && atomic_inc(&{counter}) < {breakpoint.max_hits}'
+            self._variables[breakpoint.line] = self._process_breakpoint(node, breakpoint, break_line, guard, i)
+        if self._watches is not None or self._snapshots:
+            unknown = [w.spec for w in (self._watches or []) + self._snapshots if w.name not in self._visible_names]
+            if unknown:
+                raise Exception(f'Not visible at any of the breakpoints: {", ".join(unknown)}')
+
+        if any(b.max_hits is not None for b in self._breakpoints) or self._max_launches is not None:
+            # Program scope variables outside of the constant address space came with OpenCL C 2.0
+            declarations.insert(0, '\n'.join([
+                '#if __OPENCL_C_VERSION__ < 200',
+                '#error "The hit and launch counters need OpenCL C 2.0 or newer (build with -cl-std=CL2.0)"',
+                '#endif'
+            ]))
+        if declarations:
+            self._insert_lines(self._get_parsed_line(0), declarations)
+
+    def __count_launches(self, declarations: [str]):
+        # Every kernel with breakpoints counts the work-items it's launched for: the work-items of its n-th launch
+        # get the counts from n * <global size> on, as long as the launches don't overlap and are of the same size.
+        # The counter stops growing at the last launch that prints anything, and it's 64-bit, since the work-items
+        # of the launches up to there may be 2^32 or more
+        index = self._get_block_index()
+        kernels = {}
+        for line, break_line in zip(self._lines, self._break_lines):
+            function = index.find_function(break_line + 1)
+            if function is None or not self.__is_kernel(function):
+                raise Exception(f'The launches can only be counted for the breakpoints in kernels, not at line '
+                                f'{line + 1}')
+            kernels.setdefault(function.spelling, function)
+        launches = self._max_launches
+        declarations.append('\n'.join([
+            '#ifndef cl_khr_int64_base_atomics',
+            '#error "The launch counters need 64-bit atomics (cl_khr_int64_base_atomics)"',
+            '#endif',
+            '#pragma OPENCL EXTENSION cl_khr_int64_base_atomics : enable'
+        ]))
+        for i, function in enumerate(kernels.values()):
+            counter = f'_losev_items_{i}'
+            declarations.append(f'volatile __global ulong {counter} = 0;')
+            body = next(c for c in function.get_children() if c.kind == CursorKind.COMPOUND_STMT)
+            self._insert_lines(body.extent.start.line, [
+                'size_t _losev_size = get_global_size(0) * get_global_size(1) * get_global_size(2);',
+                f'uint _losev_launch = {counter} < {launches} * _losev_size ? '
+                f'atom_inc(&{counter}) / _losev_size : {launches};'
+            ], self._get_indent(body.extent.start.line))
+        self._launch_condition = f' && _losev_launch < {launches}'
+
+    def _process_breakpoint(self, node: Cursor, breakpoint: Breakpoint, break_line: int, guard: str,
+                            number: int = 0) -> [VarInfo]:
+        line = breakpoint.line
+        # 1. Find the variables declared before the break line in the blocks containing it
+        index = self._get_block_index()
+        declarations = index.find_declarations(break_line + 1)
+
+        # 2. Generate the code
+        gid = ThreadSelector.linear_id_name
+        line_insertions = [f'int {self._counter_name} = 0; int {self._record_counter} = 0;']
+        variables = [VarInfo(c) for c in self._get_var_declarations(declarations)]
+
+        # The condition may only use what's visible at the break line
+        function = index.find_function(break_line + 1)
+        names = [v.var_name for v in variables] + ([a.spelling for a in function.get_arguments()] if function else [])
+        unknown = breakpoint.get_unknown_names(names)
+        if unknown:
+            raise Exception(f'The condition of the breakpoint at line {line + 1} uses unknown names: '
+                            f'{", ".join(unknown)}')
+
+        if self._watches is not None:
+            # The innermost declaration of a name hides the outer ones
+            visible = {v.var_name: v for v in variables}
+            variables = [w.apply(visible[w.name]) for w in self._watches if w.name in visible]
+            self._visible_names.update(visible)
+
+        # The arguments are hidden by the variables of the same name too
+        buffers = {a.spelling: a for a in (function.get_arguments() if function else [])}
+        buffers.update((c.spelling, c) for c in self._get_var_declarations(declarations))
+        snapshots = [s.apply(buffers[s.name]) for s in self._snapshots if s.name in buffers]
+        self._visible_names.update(s.name for s in self._snapshots if s.name in buffers)
 
-        # 1. Find the code block containing the break line.
-        blocks = self._find_blocks(node)
-
-        # 2. Get the indent
-        parent_blocks = blocks[-1]
-        self._indent = self._code_lines[parent_blocks.extent.start.line][:parent_blocks.extent.start.column]
-
-        # 3. Generate the code
-        counter_names = self._counter_names
-        self._line_insertions.append(
-            f'int {counter_names[0]} = 0; int {counter_names[1]} = 0; int {counter_names[2]} = 0;')
-        self._variables = []
-        for block in blocks:
-            declarations = self.get_decl_statements(block)
-            declarations = filter_node_list_by_start_line(declarations, by_line=self._break_line)
-            var_declarations = self._get_var_declarations(declarations)
-            var_declarations = [VarInfo(c) for c in var_declarations]
-            self._variables.extend(var_declarations)
-
-        for v in self._variables:
-            line = self.generate_printf(v)
-            self._line_insertions.append(line)
-
-        # 4. Pack the code inside a block
+        trace = breakpoint.trace
+        if trace is not None and function is None:
+            raise Exception(f'The breakpoint at line {line + 1} is outside of a function and cannot be traced')
+        # The traced hits are counted in the function, since the breakpoint fires in every iteration of the loops
+        # around it
+        taken = f'_losev_taken_{number}'
+        function_declarations = [f'int _losev_seen_{number} = 0, {taken} = 0;'] if trace is not None else []
+        if trace is None and breakpoint.max_hits is not None:
+            if function is None:
+                raise Exception(f'The breakpoint at line {line + 1} is outside of a function and cannot be capped')
+            function_declarations.append(f'int _losev_printed_{number} = 0;')
+            line_insertions.append(f'_losev_printed_{number} = 1;')
+        ring_insertions = []
+        if trace is not None and trace.is_ring:
+            ring = f'_losev_ring_{number}'
+            function_declarations.append(f'int {ring}_n[{trace.count}];')
+            line_insertions += [f'int {self._slot_name} = {taken}++ % {trace.count};',
+                                f'{ring}_n[{self._slot_name}] = {self._hit_name};']
+        elif trace is not None:
+            line_insertions.append(f'{taken}++;')
+
+        for i, v in enumerate(variables):
+            tag = self.__make_tag(line, i)
+            if self._max_launches is not None:
+                v.launches = self._max_launches
+            if trace is not None:
+                v.trace = trace.spec
+                tag = (tag[0] + ' %d', tag[1] + [self._hit_name if not trace.is_ring else f'{ring}_n[{self._slot_name}]'])
+            summary = v.is_array and v.watch in [None, v.var_name] and \
+                ('*' in self._summary or v.var_name in self._summary)
+            if trace is not None and trace.is_ring:
+                if summary:
+                    raise Exception(f'The summary of {v.var_name} cannot be traced with {trace.spec}')
+                declarations, store, printf = self.generate_ring(v, f'{ring}_{i}', trace.count, tag)
+                function_declarations += declarations
+                line_insertions.append(store)
+                ring_insertions += [f'{self._record_counter} = 0;', printf]
+            elif summary:
+                line_insertions += [f'{self._record_counter} = 0;', self.generate_summary(v, tag)]
+            else:
+                line_insertions += [f'{self._record_counter} = 0;', self.generate_printf(v, tag)]
+
+        snapshot_insertions = [f'int {self._counter_name} = 0; int {self._record_counter} = 0;']
+        for i, v in enumerate(snapshots, len(variables)):
+            tag = self.__make_tag(line, i)
+            if self._max_launches is not None:
+                v.launches = self._max_launches
+            snapshot_insertions.append(f'{self._record_counter} = 0;')
+            snapshot_insertions.append(self.generate_snapshot(v, tag))
+
+        # 3. Pack the code inside a block
+        block = [
+            '{ // Save debugging data',
+            f'\tsize_t {gid} = {ThreadSelector.linear_global_id};'
+        ]
+        snapshot_guard = f'{gid} == {self._snapshot_gid}{self._launch_condition}'
+        if trace is not None:
+            block.append(f'\tint {self._hit_name} = _losev_seen_{number}++;')
+            # Snapshots aren't traced, they're only printed at the first hit
+            snapshot_guard += f' && {self._hit_name} == 0'
+        if snapshots:
+            # The buffers are printed once per launch. The barrier makes the work-group of the printing work-item
+            # finish writing them, but it's only legal if all the work-items reach it: in the body of a kernel
+            if self.__is_uniform(function, break_line):
+                block.append('\tbarrier(CLK_GLOBAL_MEM_FENCE);')
+            block += [f'\tif ({snapshot_guard}) {{'] + self.__indent(snapshot_insertions) + ['\t}']
+        block += [f'\tif ({guard}) {{'] + self.__indent(line_insertions) + ['\t}', '} // Save debugging data']
+
+        if function_declarations:
+            body = next(c for c in function.get_children() if c.kind == CursorKind.COMPOUND_STMT)
+            self._insert_lines(body.extent.start.line, function_declarations, self._get_indent(body.extent.start.line))
+        self._insert_lines(break_line, block, self._get_indent(break_line))
+        if ring_insertions:
+            # The ring is printed from the oldest hit on once the outermost loop around the breakpoint is left
+            loop = self.__find_loop(function, break_line)
+            if loop is None:
+                raise Exception(f'The breakpoint at line {line + 1} is not in a loop and cannot be traced with '
+                                f'{trace.spec}')
+            first = f'{taken} > {trace.count} ? {taken} - {trace.count} : 0'
+            dump = [f'int {self._counter_name} = 0; int {self._record_counter} = 0;',
+                    f'for (int _losev_k = {first}; _losev_k < {taken}; _losev_k++) {{',
+                    f'\tint {self._slot_name} = _losev_k % {trace.count};'] + \
+                ['\t' + e for insertion in ring_insertions for e in insertion.split('\n')] + ['}']
+            block = [
+                '{ // Save debugging data',
+                f'\tsize_t {gid} = {ThreadSelector.linear_global_id};',
+                f'\tif ({taken}) {{'
+            ] + self.__indent(dump) + ['\t}', '} // Save debugging data']
+            self._insert_lines(loop.extent.end.line, block, self._get_indent(loop.extent.start.line - 1))
+        return variables + snapshots
+
+    def __make_tag(self, line: int, index: int) -> (str, [str]):
+        tag = (f'{self._record_tag} {line} %d {index} %d',
+               [f'(int){ThreadSelector.linear_id_name}', f'{self._record_counter}++'])
+        if self._max_launches is not None:
+            tag = (tag[0] + ' %u', tag[1] + ['_losev_launch'])
+        return tag
+
+    @staticmethod
+    def __indent(insertions: [str]) -> [str]:
         lines = []
-        for e in self._line_insertions:
+        for e in insertions:
             lines.extend(e.split('\n'))
-        self._line_insertions = ['\t' * 2 + e for e in lines]
-        threads_array = '_losev_target_threads'
-        thread_counter = '_losev_thread_counter'
-        initializer_list = ', '.join([str(i) for i in self._threads])
-        # TODO: something about the indents
-        self._line_insertions.insert(0, f'int {threads_array}[] = {{{initializer_list}}};')
-        self._line_insertions.insert(1,
-                                     f'if (get_global_id(0) == *{threads_array}) {{ printf("{self._magic_string}\\n"); }} \n')
-        self._line_insertions.insert(2,
-                                     f'for (int {thread_counter} = 0; {thread_counter} < {len(self._threads)}; {thread_counter}++) {{')
-        self._line_insertions.insert(3,
-                                     f'\tif (get_global_id(0) == {threads_array}[{thread_counter}]) {{ // Save '
-                                     f'debugging data')
-        self._line_insertions.append('\t} // Save debugging data')
-        self._line_insertions.append('} // ?')
-        # self._indent = self._indent[:-1]
-        # self._line_insertions.append(self._indent + '}')
-
-        self._insert_line = self._break_line
+        return ['\t' * 2 + e for e in lines]
+
+    def __find_loop(self, function: Cursor, break_line: int) -> Cursor:
+        # The outermost loop of the function the code inserted before the line goes into
+        line = break_line + 1
+        node = function
+        while node is not None:
+            inner = [c for c in node.get_children() if c.extent.start.line < line <= c.extent.end.line]
+            node = inner[0] if inner else None
+            if node is not None and node.kind in self._loop_kinds:
+                return node
+        return None
+
+    def __is_uniform(self, function: Cursor, break_line: int) -> bool:
+        # Whether the line is directly in the body of a kernel, outside of any branch or loop, and no return or
+        # goto before it may have taken some of the work-items out of the body (as with if (gid >= n) return;)
+        if function is None or len(self._get_block_index().find_blocks(break_line + 1)) != 1:
+            return False
+        if not self.__is_kernel(function):
+            return False
+        body = next(c for c in function.get_children() if c.kind == CursorKind.COMPOUND_STMT)
+        return not any(c.kind in self._exit_kinds and c.extent.start.line < break_line + 1
+                       for c in body.walk_preorder())
+
+    @staticmethod
+    def __is_kernel(function: Cursor) -> bool:
+        qualifiers = takewhile(lambda t: t.spelling != function.spelling, function.get_tokens())
+        return any(t.spelling in ['__kernel', 'kernel'] for t in qualifiers)
 
 
 if __name__ == '__main__':
-    res = PrintfInserter.gen_print_arr('i', str(10),
-                                       PrintfInserter.gen_print_arr('j', str(11), ['printf("%d", i);']))
-    for e in res:
-        print(e)
+    kernel = '\n'.join([
+        '__kernel void hello(__global int *out)',
+        '{',
+        '    int gid = get_global_id(0);',
+        '    float m[2][3];',
+        '    out[gid] = gid;',
+        '}'
+    ])
+    inserter = PrintfInserter(4, [0, 3])
+    print(inserter.process_source(kernel, 'cl'))
+    print(inserter.get_variables())
@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Union
+
+from Breakpoint import Breakpoint
+from OclDebugger import OclDebugger
+from primitives import Variable
+from SourceCache import SourceCache
+from ThreadSelector import ThreadSelector
+
+
+class DebugSession(object):
+    # The arguments of an OclDebugger session, run in a process of its own. The conditions, hit caps and traces
+    # go with the breakpoints
+    def __init__(self, kernel_file: str, binary: str, break_lines: Union[int, Breakpoint, List[Union[int, Breakpoint]]],
+                 threads: Union[ThreadSelector, list], as_ndarray: bool = False, cache_dir: str = None,
+                 summary: List[str] = (), watch: List[str] = None, spill: bool = False, snapshot: List[str] = (),
+                 snapshot_gid: int = 0, build_check: bool = True, build_options: List[str] = (),
+                 max_launches: int = None, stop_when_complete: bool = True, kill_after: float = 5.0,
+                 timeout: float = None, idle_timeout: float = None):
+        self.kernel_file = kernel_file
+        self.binary = binary
+        self.break_lines = break_lines
+        self.threads = threads
+        self.as_ndarray = as_ndarray
+        self.cache_dir = cache_dir
+        self.summary = list(summary)
+        self.watch = watch
+        self.spill = spill
+        self.snapshot = list(snapshot)
+        self.snapshot_gid = snapshot_gid
+        self.build_check = build_check
+        self.build_options = list(build_options)
+        self.max_launches = max_launches
+        self.stop_when_complete = stop_when_complete
+        self.kill_after = kill_after
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+    def run(self) -> Dict[int, List[Variable]]:
+        debugger = OclDebugger(kernel_file=self.kernel_file, binary=self.binary, as_ndarray=self.as_ndarray,
+                               cache=SourceCache(cache_dir=self.cache_dir), isolated=True, summary=self.summary,
+                               watch=self.watch, spill=self.spill, snapshot=self.snapshot,
+                               snapshot_gid=self.snapshot_gid, build_check=self.build_check,
+                               build_options=self.build_options, max_launches=self.max_launches,
+                               stop_when_complete=self.stop_when_complete, kill_after=self.kill_after,
+                               timeout=self.timeout, idle_timeout=self.idle_timeout)
+        return debugger.safe_debug(break_lines=self.break_lines, threads=self.threads)
+
+
+def _run_session(session: DebugSession):
+    try:
+        return session.run()
+    except SystemExit as e:
+        # The debugger exits when something goes wrong, which must not take the whole pool down
+        raise Exception(f'The session exited with code {e.code}')
+
+
+class DebugScheduler(object):
+    # Runs sessions in a pool of processes, each one in its own workspace
+    def __init__(self, parallelism: int = None):
+        self._parallelism = parallelism or os.cpu_count()
+
+    def run(self, sessions: List[DebugSession], return_exceptions: bool = False) -> list:
+        # The results come in the order of the sessions. If return_exceptions is set, the exception
+        # a session failed with is returned in place of its result, otherwise it's raised
+        with ProcessPoolExecutor(max_workers=self._parallelism) as executor:
+            futures = [executor.submit(_run_session, s) for s in sessions]
+            results = []
+            for future in futures:
+                exception = future.exception()
+                if exception is not None and not return_exceptions:
+                    raise exception
+                results.append(exception if exception is not None else future.result())
+            return results
@@ -0,0 +1,103 @@
+import re
+from logging import warning
+from typing import Iterable, List, Union
+
+import numpy as np
+from clang.cindex import Cursor, Type, TypeKind
+
+from primitives import ClTypes, VarInfo
+
+
+class Snapshot(object):
+    # A __global buffer (a pointer argument or variable) printed by a single work-item at the breakpoints rather
+    # than by every one of them: 'out[1024]', 'in[0:4096:16]' or 'particles[256:512]'. The stop is required,
+    # since the size of the buffer is unknown, the step samples the buffer
+    _pattern = re.compile(r'\s*([A-Za-z_]\w*)\s*\[([^\]]*)\]\s*')
+    _qualifiers = ['__global', 'const', 'volatile', 'restrict']
+
+    def __init__(self, spec: str):
+        match = self._pattern.fullmatch(spec)
+        if match is None:
+            raise Exception(f'Could not parse the snapshot {spec}, expected <buffer>[[<start>:]<stop>[:<step>]]')
+        self.spec = re.sub(r'\s+', '', spec)
+        self.name = match.group(1)
+        try:
+            bounds = [int(b) if b.strip() else None for b in match.group(2).split(':')]
+        except ValueError:
+            raise Exception(f'The bounds of the snapshot {spec} must be integer constants')
+        if len(bounds) == 1:
+            bounds = [0] + bounds
+        if len(bounds) > 3 or bounds[1] is None:
+            raise Exception(f'The snapshot {spec} needs a stop')
+        self.start = bounds[0] or 0
+        self.stop = bounds[1]
+        self.step = bounds[2] if len(bounds) > 2 and bounds[2] is not None else 1
+        if self.start < 0 or self.step <= 0:
+            raise Exception(f'The start of the snapshot {spec} must not be negative and its step must be positive')
+        if not range(self.start, self.stop, self.step):
+            raise Exception(f'The snapshot {spec} is empty')
+
+    @staticmethod
+    def make_all(snapshots: Iterable[Union[str, 'Snapshot']]) -> List['Snapshot']:
+        return [s if isinstance(s, Snapshot) else Snapshot(s) for s in snapshots]
+
+    @property
+    def count(self) -> int:
+        return len(range(self.start, self.stop, self.step))
+
+    def apply(self, node: Cursor):
+        # Returns the VarInfo of the snapshot of the buffer the declaration points to. Buffers of structs get the
+        # layout of the struct: the NumPy description of its fields and the leaves (the paths of the scalar and
+        # vector fields) they're printed by
+        pointee = node.type.get_canonical().get_pointee() if node.type.get_canonical().kind == TypeKind.POINTER \
+            else None
+        # The address space is a qualifier of the pointee, next to const or volatile: 'const __global float'
+        qualifiers = pointee.spelling.split()[:-1] if pointee is not None else []
+        if '__global' not in qualifiers:
+            raise Exception(f'{self.name} is not a __global pointer in {self.spec}')
+        info = VarInfo(node)
+        info.watch = self.spec
+        info.snapshot = [self.start, self.stop, self.step]
+        info.var_shape = [self.count]
+        pointee = pointee.get_canonical()
+        if pointee.kind == TypeKind.RECORD:
+            info.var_type = ' '.join(w for w in node.type.get_pointee().spelling.split() if w not in self._qualifiers)
+            info.fields, info.leaves = self.__get_layout(pointee)
+            if not info.leaves:
+                raise Exception(f'None of the fields of {info.var_type} can be printed in {self.spec}')
+        else:
+            info.var_type = ClTypes.from_clang(pointee)
+            if info.var_type is None:
+                raise Exception(f'Buffers of {pointee.spelling} are not supported in {self.spec}')
+        return info
+
+    def __get_layout(self, record: Type) -> (dict, list):
+        fields = {'names': [], 'formats': [], 'offsets': [], 'itemsize': record.get_size()}
+        leaves = []
+        for field in record.get_fields():
+            field_type = field.type.get_canonical()
+            shape = []
+            while field_type.kind == TypeKind.CONSTANTARRAY:
+                shape.append(field_type.element_count)
+                field_type = field_type.element_type.get_canonical()
+            if field_type.kind == TypeKind.RECORD:
+                element, element_leaves = self.__get_layout(field_type)
+                element_shape = []
+            else:
+                var_type = ClTypes.from_clang(field_type)
+                if var_type is None:
+                    warning(f'The field {field.spelling} ({field_type.spelling}) of the buffer {self.name} is skipped')
+                    continue
+                element = np.dtype(ClTypes.parser[ClTypes.get_base_type(var_type)]).str
+                element_shape = [ClTypes.get_vector_len(var_type)] if var_type in ClTypes.vector_types else []
+                element_leaves = [[[], var_type]]
+            fields['names'].append(field.spelling)
+            fields['formats'].append([element, shape + element_shape])
+            fields['offsets'].append(record.get_offset(field.spelling) // 8)
+            # Every element of an array field is a leaf (or a struct of them) of its own
+            for index in np.ndindex(*shape):
+                leaves.extend([[field.spelling] + list(index) + path, var_type] for path, var_type in element_leaves)
+        return fields, leaves
+
+    def __repr__(self):
+        return f'Snapshot({self.spec!r})'
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+# libclang is only loaded once something has to be parsed
+if TYPE_CHECKING:
+    from clang.cindex import Index, TranslationUnit
+
+
+class LruCache(object):
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self._capacity = capacity
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._capacity:
+            self._items.popitem(last=False)
+
+    def pop_oldest(self):
+        return self._items.popitem(last=False)
+
+    def is_full(self) -> bool:
+        return len(self._items) >= self._capacity
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SourceCache(object):
+    # Keeps the parsed translation units and the processed sources. The latter may also be kept on disk,
+    # so that repeated sessions don't have to parse anything
+    def __init__(self, capacity: int = 16, cache_dir: str = None):
+        self._index = None
+        self._translation_units = LruCache(capacity)
+        self._outputs = LruCache(capacity)
+        self._cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(*parts) -> str:
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def get_index(self) -> 'Index':
+        if self._index is None:
+            from clang.cindex import Index
+            self._index = Index.create()
+        return self._index
+
+    def parse(self, path: str, unsaved_files: [(str, str)], args: [str]) -> ('TranslationUnit', dict):
+        # Returns the translation unit and a dict the processors may keep what they derive from it in
+        key = self.get_key(path, unsaved_files, args)
+        entry = self._translation_units.get(key)
+        if entry is not None:
+            return entry[1:]
+
+        translation_unit = None
+        if self._translation_units.is_full():
+            _, (options, oldest, _) = self._translation_units.pop_oldest()
+            if options == (path, args):
+                # Reuse the oldest translation unit: reparsing keeps its precompiled preamble
+                translation_unit = oldest
+                translation_unit.reparse(unsaved_files=unsaved_files)
+        if translation_unit is None:
+            from clang.cindex import TranslationUnit
+            translation_unit = self.get_index().parse(path, args=args, unsaved_files=unsaved_files,
+                                                 options=TranslationUnit.PARSE_PRECOMPILED_PREAMBLE)
+        self._translation_units.put(key, ((path, args), translation_unit, {}))
+        return self._translation_units.get(key)[1:]
+
+    def __get_path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f'{key}.pickle')
+
+    def get_output(self, key: str):
+        output = self._outputs.get(key)
+        if output is None and self._cache_dir is not None and os.path.exists(self.__get_path(key)):
+            with open(self.__get_path(key), 'rb') as f:
+                output = pickle.load(f)
+            self._outputs.put(key, output)
+        return output
+
+    def put_output(self, key: str, output):
+        self._outputs.put(key, output)
+        if self._cache_dir is not None:
+            # Write to a temporary file of its own first, so that concurrent sessions (in other processes or
+            # threads) never read or write a partial file
+            path = self.__get_path(key)
+            with tempfile.NamedTemporaryFile(dir=self._cache_dir, prefix=os.path.basename(path) + '.',
+                                             delete=False) as f:
+                pickle.dump(output, f)
+            os.replace(f.name, path)
@@ -1,23 +1,52 @@
 from clang.cindex import Cursor, Index
 
+import profiling
+from PatchBuffer import PatchBuffer
+from SourceCache import SourceCache
+
 
 class SourceProcessor:
-    def __init__(self):
+    _source_dir = '/__losev__'
+    _parse_args = ['-cc1']
+
+    def __init__(self, cache: SourceCache = None):
         self._edit = []
         self._code = ""
         self._filename = None
         self._ast_root = None
+        self._ast_data = None
+        self._cache = cache
+        # The patches are recorded against the source, which may differ from the code that's parsed (see _prepare):
+        # _parsed maps the lines of the one to the ones of the other if it does
+        self._patches = None
+        self._parsed = None
 
     def process_source(self, src: str, ext='cl') -> str:
-        self._code = src
-        self._prepare()
+        key = None
+        if self._cache is not None:
+            # The processed source only depends on the source and on what the processor is asked to do
+            key = self._cache.get_key(src, ext, self._parse_args, self._get_cache_key())
+            with profiling.phase('source.cache_lookup'):
+                output = self._cache.get_output(key)
+            if output is not None:
+                profiling.count('source.cache_hits')
+                self._code, state = output
+                self._set_state(state)
+                return self._code
 
-        self._parse(ext)
-        root = self._ast_root
-        self._process(root)
-        self._apply_patches()
+        self._load(src)
+        with profiling.phase('source.prepare'):
+            self._prepare()
 
-        self._defuse()
+        with profiling.phase('source.parse'):
+            self._parse(ext)
+        root = self._ast_root
+        with profiling.phase('source.process'):
+            self._process(root)
+        with profiling.phase('source.apply_patches'):
+            self._apply_patches()
+        if key is not None:
+            self._cache.put_output(key, (self._code, self._get_state()))
         return self._code
 
     @staticmethod
@@ -34,20 +63,55 @@ class SourceProcessor:
             self.print_ast(child, level + 1)
 
     def _parse(self, ext='cl'):
-        index = Index.create()
-        translation_unit = index.parse(unsaved_files=[(f'__file__.{ext}', self._code)],
-                                       path=f'__file__.{ext}',
-                                       args=['-cc1'])
+        path = f'{self._source_dir}/__file__.{ext}'
+        unsaved_files = [(path, self._code)] + \
+                        [(f'{self._source_dir}/{name}', contents) for name, contents in self._get_headers()]
+        if self._cache is not None:
+            translation_unit, self._ast_data = self._cache.parse(path, unsaved_files, self._parse_args)
+        else:
+            index = Index.create()
+            translation_unit = index.parse(unsaved_files=unsaved_files, path=path, args=self._parse_args)
+            self._ast_data = {}
+        self._filename = path
         self._ast_root = translation_unit.cursor
 
-    def _prepare(self):
+    def _load(self, src: str):
+        # Every source gets its own patches, so that a processor may be reused
+        self._code = src
+        self._patches = PatchBuffer(src)
+        self._parsed = None
+
+    def _get_source_line(self, line: int) -> int:
+        # The line of the source a line of the parsed code comes from, or is inserted before
+        return line if self._parsed is None else self._parsed.to_original(line)[0]
+
+    def _get_parsed_line(self, line: int) -> int:
+        return line if self._parsed is None else self._parsed.to_output(line)[0]
+
+    def _get_ast_data(self, name: str, factory):
+        # Whatever is derived from the AST is built once per parse
+        if name not in self._ast_data:
+            self._ast_data[name] = factory()
+        return self._ast_data[name]
+
+    def _get_headers(self) -> [(str, str)]:
+        # (name, contents) of the headers the source may include
+        return []
+
+    def _get_cache_key(self):
+        return None
+
+    def _get_state(self):
+        return None
+
+    def _set_state(self, state):
         pass
 
-    def _defuse(self):
+    def _prepare(self):
         pass
 
     def _process(self, node: Cursor):
         pass
 
     def _apply_patches(self):
-        pass
+        self._code = self._patches.apply()
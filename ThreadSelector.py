@@ -0,0 +1,222 @@
+from abc import ABC, abstractmethod
+from itertools import count
+from typing import List, Union
+
+
+class ThreadSelector(ABC):
+    # Functions returning the id of a work-item in the given space
+    _id_functions = {
+        'global': 'get_global_id',
+        'local': 'get_local_id',
+        'group': 'get_group_id'
+    }
+    # The instrumented code stores the linear global id in a variable named linear_id_name
+    linear_id_name = '_losev_gid'
+    linear_global_id = '(get_global_id(2) * get_global_size(1) + get_global_id(1)) * get_global_size(0) ' \
+                       '+ get_global_id(0)'
+    # Sets spanning no more than that many ids are compiled to a bitmap, larger ones to a hash table
+    max_bitmap_span = 32 * 4096
+
+    # Returns a constant-time device-side condition; program scope declarations it uses are appended to
+    # the list
+    @abstractmethod
+    def compile(self, declarations: [str]) -> str:
+        pass
+
+    # Returns the number of the work-items selected if it doesn't depend on the sizes of the launch (None
+    # otherwise). The ones selected by more than a selector may be counted more than once
+    def count(self) -> Union[int, None]:
+        return None
+
+    @staticmethod
+    def get_id(space: str, dim: int) -> str:
+        if space == 'linear':
+            return ThreadSelector.linear_id_name
+        assert space in ThreadSelector._id_functions
+        assert 0 <= dim < 3
+        return f'{ThreadSelector._id_functions[space]}({dim})'
+
+    @staticmethod
+    def parse(spec: str) -> 'ThreadSelector':
+        # <n> | <start>:<stop>[:<step>] | every:<n> | {global,local,group}:<x>[,<y>[,<z>]], where the
+        # components are either of the first two forms or *
+        space, _, rest = spec.partition(':')
+        if space == 'every':
+            return EveryNth(int(rest))
+        if space in ThreadSelector._id_functions:
+            components = rest.split(',')
+            if len(components) > 3:
+                raise Exception(f'Too many dimensions in {spec}')
+            return AllOf(*[ThreadSelector.__parse_range(c, space, dim)
+                           for dim, c in enumerate(components) if c != '*'])
+        return ThreadSelector.__parse_range(spec, 'linear', 0)
+
+    @staticmethod
+    def __parse_range(spec: str, space: str, dim: int) -> 'Range':
+        bounds = spec.split(':')
+        if len(bounds) == 1:
+            return Range(int(bounds[0]), int(bounds[0]) + 1, space=space, dim=dim)
+        if len(bounds) > 3:
+            raise Exception(f'Could not parse the range {spec}')
+        start = int(bounds[0]) if bounds[0] else 0
+        stop = int(bounds[1]) if bounds[1] else None
+        step = int(bounds[2]) if len(bounds) == 3 and bounds[2] else 1
+        return Range(start, stop, step, space=space, dim=dim)
+
+
+class Range(ThreadSelector):
+    def __init__(self, start: int = 0, stop: int = None, step: int = 1, space: str = 'linear', dim: int = 0):
+        assert start >= 0 and step > 0
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.space = space
+        self.dim = dim
+
+    def compile(self, declarations: [str]) -> str:
+        work_item_id = self.get_id(self.space, self.dim)
+        if self.stop is not None and self.stop - self.start <= self.step:
+            return f'({work_item_id} == {self.start})' if self.stop > self.start else '0'
+        conditions = []
+        if self.start:
+            conditions.append(f'{work_item_id} >= {self.start}')
+        if self.stop is not None:
+            conditions.append(f'{work_item_id} < {self.stop}')
+        if self.step > 1:
+            offset = f'({work_item_id} - {self.start})' if self.start else work_item_id
+            conditions.append(f'{offset} % {self.step} == 0')
+        return '(' + ' && '.join(conditions) + ')' if conditions else '1'
+
+    def count(self) -> Union[int, None]:
+        if self.space != 'linear' or self.stop is None:
+            return None
+        return len(range(self.start, self.stop, self.step))
+
+
+class EveryNth(Range):
+    def __init__(self, n: int, space: str = 'linear', dim: int = 0):
+        Range.__init__(self, 0, None, n, space, dim)
+
+
+class IdSet(ThreadSelector):
+    # The odd multipliers of the hashes of the sparse sets, see compile
+    _bucket_hash = 0x9e3779b1
+    _slot_hash = 0x85ebca77
+
+    def __init__(self, ids: [int], space: str = 'linear', dim: int = 0):
+        assert all(i >= 0 for i in ids)
+        self.ids = sorted(set(ids))
+        self.space = space
+        self.dim = dim
+
+    def compile(self, declarations: [str]) -> str:
+        ids = self.ids
+        work_item_id = self.get_id(self.space, self.dim)
+        if not ids:
+            return '0'
+        # Arithmetic progressions (a single id or a contiguous range included) are simple range checks
+        step = ids[1] - ids[0] if len(ids) > 1 else 1
+        if all(b - a == step for a, b in zip(ids, ids[1:])):
+            return Range(ids[0], ids[-1] + 1, step, self.space, self.dim).compile(declarations)
+
+        name = f'_losev_ids_{len(declarations)}'
+        span = ids[-1] - ids[0] + 1
+        if span <= self.max_bitmap_span:
+            words = [0] * ((span + 31) // 32)
+            for i in ids:
+                words[(i - ids[0]) >> 5] |= 1 << ((i - ids[0]) & 31)
+            declarations.append(f'__constant uint {name}[] = {{{", ".join(f"{w:#x}" for w in words)}}};')
+            offset = f'({work_item_id} - {ids[0]})' if ids[0] else work_item_id
+            return f'({offset} < {span} && ({name}[{offset} >> 5] >> ({offset} & 31) & 1))'
+
+        # Too sparse for a bitmap, so fall back to a hash table: every bucket of ids has a seed that puts them
+        # in slots of their own, so a lookup reads a seed and a slot
+        bucket_bits, slot_bits, seeds, slots = self.__make_table(ids)
+        declarations.append(f'__constant uint {name}_seeds[] = {{{", ".join(str(s) for s in seeds)}}};')
+        declarations.append(f'__constant uint {name}[] = {{{", ".join(str(i) for i in slots)}}};')
+        declarations.append('\n'.join([
+            f'int {name}_find(size_t id) {{',
+            f'\tuint seed = {name}_seeds[(uint)id * {self._bucket_hash:#x}u >> {32 - bucket_bits}];',
+            f'\treturn {name}[((uint)id ^ seed) * {self._slot_hash:#x}u >> {32 - slot_bits}] == id;',
+            '}'
+        ]))
+        return f'{name}_find({work_item_id})'
+
+    @staticmethod
+    def __make_table(ids: [int]) -> (int, int, [int], [int]):
+        # Hash and displace: the largest buckets pick their seeds first, while most of the slots are free. The
+        # table is at most 80% full, the slots left free hold an id of the set, so they never match another one
+        assert ids[-1] < 1 << 32
+
+        def hash_bits(value: int, multiplier: int, bits: int) -> int:
+            return (value * multiplier & 0xffffffff) >> (32 - bits)
+
+        bucket_bits = max(1, (len(ids) // 4 - 1).bit_length())
+        slot_bits = max(1, (len(ids) * 5 // 4).bit_length())
+        buckets = [[] for _ in range(1 << bucket_bits)]
+        for i in ids:
+            buckets[hash_bits(i, IdSet._bucket_hash, bucket_bits)].append(i)
+        seeds = [0] * len(buckets)
+        slots = [None] * (1 << slot_bits)
+        for b in sorted(range(len(buckets)), key=lambda b: -len(buckets[b])):
+            if not buckets[b]:
+                break
+            for seed in count():
+                taken = {hash_bits(i ^ seed, IdSet._slot_hash, slot_bits) for i in buckets[b]}
+                if len(taken) == len(buckets[b]) and all(slots[t] is None for t in taken):
+                    break
+            seeds[b] = seed
+            for i in buckets[b]:
+                slots[hash_bits(i ^ seed, IdSet._slot_hash, slot_bits)] = i
+        return bucket_bits, slot_bits, seeds, [ids[0] if i is None else i for i in slots]
+
+    def count(self) -> Union[int, None]:
+        return len(self.ids) if self.space == 'linear' else None
+
+
+class GlobalIds(IdSet):
+    def __init__(self, ids: [int], dim: int = None):
+        IdSet.__init__(self, ids, 'linear' if dim is None else 'global', dim or 0)
+
+
+class WorkGroups(IdSet):
+    def __init__(self, groups: [int], dim: int = 0):
+        IdSet.__init__(self, groups, 'group', dim)
+
+
+class AllOf(ThreadSelector):
+    def __init__(self, *selectors: ThreadSelector):
+        self.selectors = selectors
+
+    def compile(self, declarations: [str]) -> str:
+        if not self.selectors:
+            return '1'
+        return '(' + ' && '.join(s.compile(declarations) for s in self.selectors) + ')'
+
+    def count(self) -> Union[int, None]:
+        return self.selectors[0].count() if len(self.selectors) == 1 else None
+
+
+class AnyOf(ThreadSelector):
+    def __init__(self, *selectors: ThreadSelector):
+        self.selectors = selectors
+
+    def compile(self, declarations: [str]) -> str:
+        if not self.selectors:
+            return '0'
+        return '(' + ' || '.join(s.compile(declarations) for s in self.selectors) + ')'
+
+    def count(self) -> Union[int, None]:
+        counts = [s.count() for s in self.selectors]
+        return None if None in counts else sum(counts)
+
+
+def make_selector(threads: Union[ThreadSelector, List[Union[int, str, ThreadSelector]]]) -> ThreadSelector:
+    # Plain ids are merged into a single set, strings are parsed, the rest is joined with OR
+    if isinstance(threads, ThreadSelector):
+        return threads
+    ids = [t for t in threads if isinstance(t, int)]
+    selectors = [ThreadSelector.parse(t) if isinstance(t, str) else t for t in threads if not isinstance(t, int)]
+    if ids:
+        selectors.insert(0, GlobalIds(ids))
+    return selectors[0] if len(selectors) == 1 else AnyOf(*selectors)
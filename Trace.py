@@ -0,0 +1,41 @@
+import re
+from typing import Union
+
+
+class Trace(object):
+    # Which hits of a breakpoint a work-item prints when the breakpoint is in a loop, rather than only the first
+    # one: 'first:<n>' the first n, 'last:<n>' the last n (kept in a ring in private memory and printed once the
+    # outermost loop around the breakpoint is left) or 'every:<k>:<n>' every k-th hit, n of them at most.
+    # The hits are counted per work-item from 0 (per call of the function the breakpoint is in)
+    _pattern = re.compile(r'\s*(first|last|every)\s*:\s*([0-9]+)\s*(?::\s*([0-9]+)\s*)?')
+
+    def __init__(self, spec: str):
+        match = self._pattern.fullmatch(spec)
+        if match is None:
+            raise Exception(f'Could not parse the trace {spec}, expected first:<n>, last:<n> or every:<k>:<n>')
+        self.spec = re.sub(r'\s+', '', spec)
+        self.mode = match.group(1)
+        if self.mode == 'every':
+            # The cap is required, so that the output stays bounded whatever the number of iterations
+            if match.group(3) is None:
+                raise Exception(f'The trace {spec} needs a cap: every:<k>:<n>')
+            self.step = int(match.group(2))
+            self.count = int(match.group(3))
+        else:
+            if match.group(3) is not None:
+                raise Exception(f'Could not parse the trace {spec}, expected {self.mode}:<n>')
+            self.step = 1
+            self.count = int(match.group(2))
+        if self.step <= 0 or self.count <= 0:
+            raise Exception(f'The numbers of the trace {spec} must be positive')
+
+    @staticmethod
+    def make(trace: Union[str, 'Trace', None]) -> Union['Trace', None]:
+        return Trace(trace) if isinstance(trace, str) else trace
+
+    @property
+    def is_ring(self) -> bool:
+        return self.mode == 'last'
+
+    def __repr__(self):
+        return f'Trace({self.spec!r})'
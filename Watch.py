@@ -0,0 +1,84 @@
+import re
+from itertools import zip_longest
+from typing import Iterable, List, Union
+
+
+class Watch(object):
+    # A variable to print at the breakpoints, optionally narrowed down to a slice of an array and to some
+    # components of a vector: 'acc', 'acc[0:64:4]', 'tile[3][:]', 'v.s0123' or 'points[:8].xy'.
+    # The subscripts follow the Python slicing rules, the missing trailing ones take the whole dimension
+    _pattern = re.compile(r'\s*([A-Za-z_]\w*)\s*((?:\[[^\]]*\]\s*)*)(?:\.\s*(\w+))?\s*')
+    _named_components = {'x': 0, 'y': 1, 'z': 2, 'w': 3}
+
+    def __init__(self, spec: str):
+        match = self._pattern.fullmatch(spec)
+        if match is None:
+            raise Exception(f'Could not parse the watch expression {spec}')
+        self.spec = re.sub(r'\s+', '', spec)
+        self.name = match.group(1)
+        self.subscripts = [s.strip() for s in re.findall(r'\[([^\]]*)\]', match.group(2))]
+        self.components = match.group(3)
+
+    @staticmethod
+    def make_all(watches: Iterable[Union[str, 'Watch']]) -> List['Watch']:
+        return [w if isinstance(w, Watch) else Watch(w) for w in watches]
+
+    def apply(self, info):
+        # Returns a copy of the VarInfo with the shape and the type of what's watched. The subscripts are kept in
+        # slices: an index or [start, stop, step] for every declared dimension
+        from primitives import ClTypes, VarInfo
+        info = VarInfo.from_dict({k: list(v) if isinstance(v, list) else v for k, v in info.__dict__.items()})
+        info.watch = self.spec
+
+        declared_shape = info.var_shape if info.is_array else []
+        if len(self.subscripts) > len(declared_shape):
+            raise Exception(f'Too many subscripts in {self.spec}')
+        if self.subscripts:
+            info.slices = [self.__get_slice(n, s) for n, s in zip_longest(declared_shape, self.subscripts)]
+            info.var_shape = [len(range(*s)) for s in info.slices if isinstance(s, list)]
+            info.is_array = bool(info.var_shape)
+
+        if self.components is not None:
+            n = ClTypes.get_vector_len(info.var_type)
+            if info.var_type not in ClTypes.vector_types:
+                raise Exception(f'{self.name} is not a vector in {self.spec}')
+            indexes = self.__get_component_indexes(self.components, n)
+            if not indexes or any(i >= n for i in indexes) or len(indexes) not in [1] + ClTypes.vector_len:
+                raise Exception(f'Wrong vector components in {self.spec}')
+            info.components = self.components
+            base_type = ClTypes.get_base_type(info.var_type)
+            info.var_type = base_type if len(indexes) == 1 else f'{base_type}{len(indexes)}'
+        return info
+
+    def __get_slice(self, n: int, subscript: str) -> Union[int, List[int]]:
+        if subscript is None:
+            return [0, n, 1]
+        try:
+            if ':' not in subscript:
+                index = int(subscript)
+                if not -n <= index < n:
+                    raise Exception(f'Index {index} is out of the bounds of {self.spec}')
+                return index % n
+            bounds = [int(b) if b.strip() else None for b in subscript.split(':')]
+        except ValueError:
+            raise Exception(f'Subscripts must be integer constants in {self.spec}')
+        if len(bounds) > 3 or bounds[2:] == [0]:
+            raise Exception(f'Could not parse the slice [{subscript}] in {self.spec}')
+        indexes = range(*slice(*bounds).indices(n))
+        if not indexes:
+            raise Exception(f'The slice [{subscript}] of {self.spec} is empty')
+        return [indexes.start, indexes.stop, indexes.step]
+
+    @staticmethod
+    def __get_component_indexes(components: str, n: int) -> [int]:
+        halves = {'lo': range(n // 2), 'hi': range(n // 2, n), 'even': range(0, n, 2), 'odd': range(1, n, 2)}
+        if components in halves:
+            return list(halves[components])
+        if re.fullmatch('[xyzw]+', components):
+            return [Watch._named_components[c] for c in components]
+        if re.fullmatch('[sS][0-9a-fA-F]+', components):
+            return [int(c, 16) for c in components[1:]]
+        return []
+
+    def __repr__(self):
+        return f'Watch({self.spec!r})'
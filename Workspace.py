@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+
+import profiling
+
+
+class Workspace(object):
+    # A copy of the directory of the binary (and of the directory of the kernel, if it's elsewhere) laid out
+    # the same way relative to each other, so that a session may rewrite the kernel without touching the
+    # original files. Note: the binary must refer to the kernel with a relative path
+    def __init__(self, kernel_file: str, binary_dir: str, root: str = None):
+        self._kernel_file = os.path.abspath(kernel_file)
+        self._kernel_dir = os.path.dirname(self._kernel_file)
+        self._binary_dir = os.path.abspath(binary_dir)
+        self._root = root
+        self._dir = None
+        self.kernel_file = None
+        self.binary_dir = None
+
+    def __enter__(self) -> 'Workspace':
+        with profiling.phase('workspace.copy'):
+            return self.__create()
+
+    def __create(self) -> 'Workspace':
+        self._dir = tempfile.mkdtemp(prefix='ocl_debugger_', dir=self._root)
+        try:
+            common = os.path.commonpath([self._binary_dir, self._kernel_dir])
+            base = os.path.join(self._dir, os.path.basename(common) or 'root')
+            self.binary_dir = os.path.normpath(os.path.join(base, os.path.relpath(self._binary_dir, common)))
+            self.kernel_file = os.path.normpath(os.path.join(base, os.path.relpath(self._kernel_file, common)))
+
+            shutil.copytree(self._binary_dir, self.binary_dir, symlinks=True)
+            kernel_dir = os.path.dirname(self.kernel_file)
+            if not os.path.isdir(kernel_dir):
+                # Only the files next to the kernel (e.g. the headers it includes) are copied
+                os.makedirs(kernel_dir)
+                for name in os.listdir(self._kernel_dir):
+                    path = os.path.join(self._kernel_dir, name)
+                    if os.path.isfile(path):
+                        shutil.copy2(path, kernel_dir)
+        except BaseException:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with profiling.phase('workspace.remove'):
+            shutil.rmtree(self._dir, ignore_errors=True)
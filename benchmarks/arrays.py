@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import timeit
+from math import prod
+
+import numpy as np
+
+from benchmarks.decoder import make_info, to_hex
+from benchmarks.pipeline import get_record_sizes, split_records
+from benchmarks.printf import count_printf
+from OclDebugger import OclDebugger
+from PrintfInserter import PrintfInserter
+from primitives import ClTypes, Variable
+
+N_THREADS = 4
+# var_type, declared shape and the watches to check besides the whole array
+CASES = [
+    ('float', [37], ['v[::-3]']),
+    ('int', [3, 5], ['v[1:][::2]', 'v[:][4]']),
+    ('short', [2, 3, 4], ['v[1][::-1][1:3]', 'v[:][2][::2]']),
+    ('uchar', [2, 2, 3, 3], ['v[::-1][1][:][::2]']),
+    ('double', [2, 1, 2, 3, 2], ['v[1][0][:][1:][:]']),
+    ('int4', [2, 2, 1, 2, 2, 3], ['v[:][1][0][::-1][1][:2].wz', 'v[1][::-1][0][:][:][2].s1']),
+    ('char2', [3, 2, 2, 2, 2, 2], ['v[2:0:-1][1][:][1][::2][:].x'])
+]
+
+
+def get_pattern(base_type: str, n: int, gid) -> np.ndarray:
+    # The components of the elements of the arrays the kernel fills, in the order of the flattened array
+    k = np.arange(n, dtype=np.int64)
+    if base_type in ClTypes.float_types:
+        return ((k - 3 * gid) * 0.25).astype(ClTypes.parser[base_type])
+    values = (k * 37 + gid * 11) % 101
+    return (values - 50 if base_type in ClTypes.signed_integer_types else values).astype(ClTypes.parser[base_type])
+
+
+# The line of the loop filling the array, where it's not initialized yet
+FILL_LINE = 4
+
+
+def make_kernel(var_type: str, var_shape: [int]) -> (str, int):
+    # Returns the source and the break line (counted from 0)
+    base_type = ClTypes.get_base_type(var_type)
+    n = prod(var_shape) * ClTypes.get_vector_len(var_type)
+    if base_type in ClTypes.float_types:
+        value = f'({base_type})((long)_k - 3 * (long)gid) * 0.25'
+    else:
+        value = f'(_k * 37 + gid * 11) % 101' + (' - 50' if base_type in ClTypes.signed_integer_types else '')
+    lines = [
+        '__kernel void fill(__global int *out)',
+        '{',
+        '    int gid = get_global_id(0);',
+        f'    {var_type} v{"".join(f"[{d}]" for d in var_shape)};',
+        f'    for (int _k = 0; _k < {n}; _k++)',
+        f'        ((__private {base_type} *)v)[_k] = ({base_type})({value});',
+        '    out[gid] = gid;',
+        '}'
+    ]
+    return '\n'.join(lines) + '\n', 6
+
+
+def make_host(directory: str) -> str:
+    # Builds kernel.cl from its directory and runs it over a few work-items with PyOpenCL
+    binary = os.path.join(directory, 'host')
+    with open(binary, 'w') as f:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        f.write(f'#!/bin/sh\nPYTHONPATH={root} exec {sys.executable} -m benchmarks.arrays --host\n')
+    os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+    return binary
+
+
+def run_host():
+    import pyopencl as cl
+    context = cl.create_some_context(interactive=False)
+    queue = cl.CommandQueue(context)
+    with open('kernel.cl') as f:
+        program = cl.Program(context, f.read()).build()
+    out = cl.Buffer(context, cl.mem_flags.WRITE_ONLY, N_THREADS * 4)
+    program.fill(queue, (N_THREADS,), None, out)
+    queue.finish()
+
+
+def select(array: np.ndarray, watch: str) -> np.ndarray:
+    # What a watch selects from the array, with the same Python slicing rules
+    spec = watch[1:]
+    components = None
+    if '.' in spec:
+        spec, components = spec.split('.')
+    subscripts = [s[1:] for s in spec.split(']') if s]
+    index = tuple(int(s) if ':' not in s else slice(*[int(b) if b else None for b in s.split(':')])
+                  for s in subscripts)
+    selected = array[index]
+    if components is not None:
+        named = {'x': 0, 'y': 1, 'z': 2, 'w': 3}
+        indexes = [named[c] for c in components] if components[0] in named else \
+            [int(c, 16) for c in components[1:]]
+        selected = selected[..., indexes[0]] if len(indexes) == 1 else selected[..., indexes]
+    return selected
+
+
+def check_case(var_type: str, var_shape: [int], watches: [str], directory: str) -> float:
+    source, break_line = make_kernel(var_type, var_shape)
+    kernel_file = os.path.join(directory, 'kernel.cl')
+    with open(kernel_file, 'w') as f:
+        f.write(source)
+    base_type = ClTypes.get_base_type(var_type)
+    n_components = ClTypes.get_vector_len(var_type)
+    shape = tuple(var_shape) + ((n_components,) if var_type in ClTypes.vector_types else ())
+
+    start = timeit.default_timer()
+    for watch in ['v'] + watches:
+        debugger = OclDebugger(kernel_file, make_host(directory), as_ndarray=True, watch=[watch])
+        variables = debugger.safe_debug(break_line, list(range(N_THREADS)))[break_line]
+        assert [v.gid for v in variables] == list(range(N_THREADS)), watch
+        for v in variables:
+            expected = select(get_pattern(base_type, prod(shape), v.gid).reshape(shape), watch)
+            if not np.array_equal(v.value, expected):
+                raise Exception(f'{var_type} {watch}: expected {expected.tolist()}, got {v.value.tolist()}')
+    return timeit.default_timer() - start
+
+
+def check_uninitialized(var_type: str, var_shape: [int], directory: str) -> float:
+    # Breaks before the array is filled: whatever its values are, every work-item has to print records that pass
+    # their checksums
+    source, _ = make_kernel(var_type, var_shape)
+    kernel_file = os.path.join(directory, 'kernel.cl')
+    with open(kernel_file, 'w') as f:
+        f.write(source)
+
+    start = timeit.default_timer()
+    debugger = OclDebugger(kernel_file, make_host(directory), as_ndarray=True)
+    variables = debugger.safe_debug(FILL_LINE, list(range(N_THREADS)))[FILL_LINE]
+    gids = sorted(v.gid for v in variables if v.info.var_name == 'v')
+    if gids != list(range(N_THREADS)):
+        raise Exception(f'uninitialized {var_type}: got the records of the work-items {gids} only')
+    return timeit.default_timer() - start
+
+
+def make_records(info, values: np.ndarray, address: int, chunk_size: int) -> [str]:
+    # The records a work-item prints for the selected values, the array header and the elements in order (with
+    # their components separated by commas), split the same way generate_printf splits them
+    if info.var_type in ClTypes.vector_types:
+        elements = [','.join(to_hex(e)) for e in values.reshape(-1, ClTypes.get_vector_len(info.var_type))]
+    else:
+        elements = to_hex(values.reshape(-1))
+    if info.is_array:
+        elements = to_hex(np.array([address], dtype=ClTypes.parser['uint'])) + elements
+    return split_records(elements, get_record_sizes(info, chunk_size))
+
+
+def check_case_offline(var_type: str, var_shape: [int], watches: [str]) -> float:
+    # The same round trip without a device: the records of every work-item are made from the values the watches
+    # select and the layout of the variable, then read and decoded the way a session does
+    source, break_line = make_kernel(var_type, var_shape)
+    base_type = ClTypes.get_base_type(var_type)
+    n_components = ClTypes.get_vector_len(var_type)
+    shape = tuple(var_shape) + ((n_components,) if var_type in ClTypes.vector_types else ())
+    tag = PrintfInserter.get_record_tag()
+
+    start = timeit.default_timer()
+    for watch in ['v'] + watches:
+        inserter = PrintfInserter(break_line, list(range(N_THREADS)), watch=[watch])
+        inserter.process_source(source)
+        variables = inserter.get_variables()
+        info = variables[break_line][0]
+        expected = [select(get_pattern(base_type, prod(shape), gid).reshape(shape), watch)
+                    for gid in range(N_THREADS)]
+        lines = [f'{tag} {break_line} {gid} 0 {i} {record}'.encode('ascii') for gid in range(N_THREADS)
+                 for i, record in enumerate(make_records(info, expected[gid], 0x1000 * gid, inserter._chunk_size))]
+
+        async def read():
+            async def batches():
+                yield lines[::-1]
+            return [e async for completed in OclDebugger._stream_records(variables, batches()) for e in completed]
+
+        records = asyncio.run(read())
+        decoded = Variable.decode_all(info, [r[-1] for r in records], [r[2] for r in records], as_ndarray=True)
+        assert sorted(v.gid for v in decoded) == list(range(N_THREADS)), watch
+        for v in decoded:
+            if not np.array_equal(v.value, expected[v.gid]):
+                raise Exception(f'{var_type} {watch}: expected {expected[v.gid].tolist()}, got {v.value.tolist()}')
+    return timeit.default_timer() - start
+
+
+def main(argv: [str]):
+    # Round-trips arrays of every rank up to 6 through the generated code, a device (or records made from their
+    # layout with --no-device) and the decoder, and reports the code generate_printf emits for them
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks.arrays')
+    parser.add_argument('--host', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--no-device', action='store_true',
+                        help='decode records made from the layout of the arrays instead of running the kernels')
+    args = parser.parse_args(argv)
+    if args.host:
+        return run_host()
+
+    # Exits with 1 if any of the round trips doesn't give the values back, so it may run as a check
+    inserter = PrintfInserter([], [])
+    failed = False
+    print(f'{"variable":<24} {"lines":>6} {"loops":>6} {"calls":>6} {"bytes":>7} {"round trip, s":>14}')
+    with tempfile.TemporaryDirectory(prefix='ocl_debugger_arrays_') as directory:
+        for var_type, var_shape, watches in CASES:
+            code = inserter.generate_printf(make_info(var_type, var_shape))
+            calls, size = count_printf(code)
+            loops = code.count('while (')
+            name = var_type + ''.join(f'[{n}]' for n in var_shape)
+            try:
+                t = check_case_offline(var_type, var_shape, watches) if args.no_device else \
+                    check_case(var_type, var_shape, watches, directory)
+            except Exception as e:
+                print(f'{name:<24} {len(code.splitlines()):>6} {loops:>6} {calls:>6} {size:>7} {"FAILED":>14}')
+                print(e, file=sys.stderr)
+                failed = True
+                continue
+            print(f'{name:<24} {len(code.splitlines()):>6} {loops:>6} {calls:>6} {size:>7} {t:>14.3f}')
+        if not args.no_device:
+            var_type, var_shape, _ = CASES[0]
+            name = 'uninitialized ' + var_type + ''.join(f'[{n}]' for n in var_shape)
+            try:
+                t = f'{check_uninitialized(var_type, var_shape, directory):.3f}'
+            except Exception as e:
+                print(e, file=sys.stderr)
+                t = 'FAILED'
+                failed = True
+            print(f'{name:<24} {"":>6} {"":>6} {"":>6} {"":>7} {t:>14}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
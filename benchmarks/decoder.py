@@ -0,0 +1,111 @@
+import re
+import sys
+import timeit
+from math import prod
+
+import numpy as np
+
+from primitives import ClTypes, VarInfo, Variable
+
+
+# The per-element parser Variable used to have (for the bits every value is printed as now); kept here as
+# the reference point
+def legacy_parse_scalar(value, var_type):
+    dtype = np.dtype(ClTypes.parser[var_type])
+    return np.array(int(value, base=16), dtype=f'u{dtype.itemsize}').view(dtype).item()
+
+
+def legacy_parse_value(value, var_type):
+    if var_type in ClTypes.vector_types:
+        base = re.search('[a-z]+', var_type).group(0)
+        return [legacy_parse_scalar(e, base) for e in value.split(',')]
+    return legacy_parse_scalar(value, var_type)
+
+
+def legacy_parse_array(arr: [str], var_shape: [int], var_type: str):
+    if len(var_shape) == 1:
+        return [legacy_parse_value(arr[0], ClTypes.pointer_type), [legacy_parse_value(v, var_type) for v in arr[1:]]]
+    size = len(arr[1:]) // var_shape[0]
+    return [legacy_parse_value(arr[0], ClTypes.pointer_type)] + \
+        [legacy_parse_array(arr[1 + i * size: 1 + (i + 1) * size], var_shape[1:], var_type) for i in range(var_shape[0])]
+
+
+def make_info(var_type: str, var_shape: [int]) -> VarInfo:
+    full_type = f'__private {var_type}' + (' ' + ''.join(f'[{n}]' for n in var_shape) if var_shape else '')
+    return VarInfo.from_dict({'var_name': 'v', 'full_type': full_type, 'address_space': '__private',
+                              'var_type': var_type, 'is_array': bool(var_shape), 'var_shape': var_shape,
+                              'pointer_rank': 0})
+
+
+def to_hex(values: np.ndarray) -> [str]:
+    # The bits of the values in fixed-width hex, as the instrumented kernels print them
+    digits = values.astype(values.dtype.newbyteorder('>')).tobytes().hex()
+    width = 2 * values.dtype.itemsize
+    return [digits[i:i + width] for i in range(0, len(digits), width)]
+
+
+def make_record(var_type: str, var_shape: [int], rng) -> str:
+    base_type = ClTypes.get_base_type(var_type)
+    dtype = ClTypes.parser[base_type]
+
+    def element():
+        n = ClTypes.get_vector_len(var_type)
+        if base_type in ClTypes.float_types:
+            components = rng.standard_normal(n).astype(dtype)
+        else:
+            components = rng.integers(-50 if base_type in ClTypes.signed_integer_types else 0, 100, n).astype(dtype)
+        return ','.join(to_hex(components))
+
+    if not var_shape:
+        return element()
+    return ' '.join(['deadbeef'] + [element() for _ in range(prod(var_shape))])
+
+
+def to_legacy_record(record: str, var_shape: [int]) -> str:
+    # The layout arrays used to be printed in: a header before every sub-array
+    elements = iter(record.split(' ')[1:])
+
+    def array(shape):
+        if len(shape) == 1:
+            return ['deadbeef'] + [next(elements) for _ in range(shape[0])]
+        return ['deadbeef'] + [e for _ in range(shape[0]) for e in array(shape[1:])]
+
+    return ' '.join(array(var_shape)) if var_shape else record
+
+
+def strip_headers(value, n_dims: int):
+    if n_dims == 1:
+        return value[1]
+    return [strip_headers(v, n_dims - 1) for v in value[1:]]
+
+
+def main(argv: [str]):
+    n_threads = int(argv[0]) if argv else 1000
+    rng = np.random.default_rng(0)
+    cases = [('int', []), ('float4', []), ('float', [256]), ('int', [16, 16]), ('double', [4, 8, 8])]
+    print(f'{"variable":<20} {"per-element, s":>15} {"vectorized, s":>15} {"speedup":>8}')
+    for var_type, var_shape in cases:
+        info = make_info(var_type, var_shape)
+        records = [make_record(var_type, var_shape, rng) for _ in range(n_threads)]
+        gids = list(range(n_threads))
+
+        legacy_records = [to_legacy_record(r, var_shape) for r in records]
+
+        def legacy():
+            if var_shape:
+                return [legacy_parse_array(r.split(' '), var_shape, var_type) for r in legacy_records]
+            return [legacy_parse_value(r, var_type) for r in legacy_records]
+
+        def vectorized():
+            return Variable.decode_all(info, records, gids, as_ndarray=True)
+
+        expected = [strip_headers(v, len(var_shape)) for v in legacy()] if var_shape else legacy()
+        assert [v.value.tolist() for v in vectorized()] == expected
+        t_legacy = min(timeit.repeat(legacy, number=1, repeat=3))
+        t_vectorized = min(timeit.repeat(vectorized, number=1, repeat=3))
+        name = var_type + ''.join(f'[{n}]' for n in var_shape)
+        print(f'{name:<20} {t_legacy:>15.4f} {t_vectorized:>15.4f} {t_legacy / t_vectorized:>7.1f}x')
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import os
+import stat
+import sys
+import tempfile
+import timeit
+from math import prod
+
+import numpy as np
+
+from benchmarks.decoder import make_record
+from OclDebugger import OclDebugger
+from PrintfInserter import PrintfInserter
+from primitives import ClTypes, VarInfo, Variable
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+PHASES = ['parse', 'find_blocks', 'codegen', 'apply_patches', 'read', 'decode']
+# Differences below that are noise rather than regressions
+MIN_DIFFERENCE = 0.001
+TYPES = ['int', 'float', 'float4', 'char', 'double', 'uint', 'short2', 'long']
+
+# name: (variables, nesting depth, filler blocks, breakpoints, array shapes)
+CASES = {
+    'small': (4, 1, 0, 1, [[]]),
+    'variables-64': (64, 1, 0, 1, [[]]),
+    'depth-16': (16, 16, 0, 4, [[]]),
+    'arrays': (8, 2, 0, 1, [[256], [16, 16], [4, 8, 8], [3]]),
+    'large-source': (16, 4, 2000, 4, [[], [32]])
+}
+
+
+def make_kernel(n_vars: int, depth: int, n_filler: int, n_breakpoints: int, shapes: [[int]]) -> (str, [int]):
+    # A kernel with the variables spread over the nested blocks and sibling blocks before them. Returns the source
+    # and the break lines (counted from 0), the last ones go to the innermost blocks
+    lines = ['__kernel void bench(__global float *out)', '{', '    int gid = get_global_id(0);']
+    for i in range(n_filler):
+        lines += [f'    if (gid == -{i + 1}) {{', f'        out[0] = {i};', '    }']
+    statements = []
+    for level in range(depth + 1):
+        indent = '    ' * (level + 1)
+        for i in range(level, n_vars, depth + 1):
+            shape = shapes[i % len(shapes)]
+            lines.append(f'{indent}{TYPES[i % len(TYPES)]} v{i}{"".join(f"[{n}]" for n in shape)};')
+        statements.append(len(lines))
+        lines.append(f'{indent}out[gid] = {level};')
+        if level < depth:
+            lines.append(f'{indent}if (gid >= {level}) {{')
+    for level in reversed(range(depth)):
+        lines.append('    ' * (level + 1) + '}')
+    lines.append('}')
+    return '\n'.join(lines) + '\n', statements[-n_breakpoints:]
+
+
+def get_record_sizes(info: VarInfo, chunk_size: int) -> [int]:
+    # The number of values every record of the variable has, the same way generate_printf splits them
+    if not info.is_array:
+        return [1]
+    count = prod(info.var_shape)
+    if count <= chunk_size:
+        return [1 + count]
+    return [1] + [chunk_size] * (count // chunk_size) + ([count % chunk_size] if count % chunk_size else [])
+
+
+def split_records(tokens: [str], sizes: [int]) -> [str]:
+    # Every record carries the length and the checksum of its values, see PrintfInserter
+    offsets = np.cumsum([0] + sizes)
+    records = [' '.join(tokens[a:b]) for a, b in zip(offsets, offsets[1:])]
+    return [f'{len(r)} {int(r.replace(" ", "").replace(",", ""), 16) % ClTypes.checksum_modulus:02x} {r}'
+            for r in records]
+
+
+def make_output(variables: {int: [VarInfo]}, n_threads: int, chunk_size: int, rng) -> [str]:
+    # The lines the instrumented kernel prints, interleaved the way the records of different work-items may be
+    tag = PrintfInserter.get_record_tag()
+    output = []
+    for line, infos in variables.items():
+        for index, info in enumerate(infos):
+            tokens = make_record(info.var_type, info.var_shape if info.is_array else [], rng).split(' ')
+            sizes = get_record_sizes(info, chunk_size)
+            assert sum(sizes) == len(tokens) and len(sizes) == info.n_records
+            records = split_records(tokens, sizes)
+            for gid in range(n_threads):
+                output.extend(f'{tag} {line} {gid} {index} {r} {value}' for r, value in enumerate(records))
+    rng.shuffle(output)
+    return output
+
+
+def make_host(directory: str, output: [str]) -> str:
+    # A stand-in for the host executable, which prints what the kernel would
+    with open(os.path.join(directory, 'output.txt'), 'w') as f:
+        f.write('\n'.join(output) + '\n')
+    binary = os.path.join(directory, 'host')
+    with open(binary, 'w') as f:
+        f.write('#!/bin/sh\nexec cat output.txt\n')
+    os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+    return binary
+
+
+def run_case(case: tuple, n_threads: int, repeat: int, directory: str) -> {str: float}:
+    source, break_lines = make_kernel(*case)
+    times = {phase: [] for phase in PHASES}
+
+    def measure(phase, f):
+        start = timeit.default_timer()
+        result = f()
+        times[phase].append(timeit.default_timer() - start)
+        return result
+
+    inserter = None
+    for _ in range(repeat):
+        inserter = PrintfInserter(break_lines, [f'0:{n_threads}'])
+        inserter._load(source)
+        inserter._prepare()
+        measure('parse', lambda: inserter._parse('cl'))
+        measure('find_blocks', lambda: [inserter._find_blocks(line) for line in inserter._break_lines])
+        measure('codegen', lambda: inserter._process(inserter._ast_root))
+        measure('apply_patches', inserter._apply_patches)
+
+    variables = inserter.get_variables()
+    binary = make_host(directory, make_output(variables, n_threads, inserter._chunk_size, np.random.default_rng(0)))
+    debugger = OclDebugger(os.path.join(directory, 'kernel.cl'), binary)
+    debugger._session_dir = directory
+
+    async def read():
+        records = {}
+        async for completed in debugger._stream_records(variables, debugger.value_generator()):
+            for line, index, gid, _, _, value in completed:
+                records.setdefault((line, index), ([], []))
+                records[line, index][0].append(gid)
+                records[line, index][1].append(value)
+        return records
+
+    def decode(records):
+        return [Variable.decode_all(variables[line][index], values, gids, as_ndarray=True)
+                for (line, index), (gids, values) in records.items()]
+
+    for _ in range(repeat):
+        loop = asyncio.new_event_loop()
+        try:
+            records = measure('read', lambda: loop.run_until_complete(read()))
+        finally:
+            loop.close()
+        assert sum(len(gids) for gids, _ in records.values()) == n_threads * sum(len(v) for v in variables.values())
+        measure('decode', lambda: decode(records))
+    return {phase: min(t) for phase, t in times.items()}
+
+
+def main(argv: [str]):
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks.pipeline')
+    parser.add_argument('cases', nargs='*', default=list(CASES), help=f'any of {", ".join(CASES)}')
+    parser.add_argument('--threads', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', action='store_true', help=f'store the results as the baselines in {BASELINES}')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='report the phases that are that many times slower than their baselines')
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+    baseline_cases = baselines.get('cases', {}) if baselines.get('threads') == args.threads else {}
+
+    results = {}
+    regressions = []
+    print(f'{"case":<14} {"phase":<14} {"time, s":>10} {"baseline, s":>12} {"ratio":>7}')
+    with tempfile.TemporaryDirectory(prefix='ocl_debugger_bench_') as directory:
+        for name in args.cases:
+            results[name] = run_case(CASES[name], args.threads, args.repeat, directory)
+            for phase, t in results[name].items():
+                baseline = baseline_cases.get(name, {}).get(phase)
+                if baseline is None:
+                    print(f'{name:<14} {phase:<14} {t:>10.4f} {"-":>12} {"-":>7}')
+                    continue
+                ratio = t / baseline
+                if ratio > args.tolerance and t - baseline > MIN_DIFFERENCE:
+                    regressions.append(f'{name}/{phase}')
+                print(f'{name:<14} {phase:<14} {t:>10.4f} {baseline:>12.4f} {ratio:>6.2f}x')
+
+    if args.save:
+        with open(BASELINES, 'w') as f:
+            json.dump({'threads': args.threads, 'cases': {**baseline_cases, **results}}, f, indent=2)
+            f.write('\n')
+    if regressions:
+        print(f'Slower than the baselines: {", ".join(regressions)}')
+        return 1
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+import re
+import sys
+
+from primitives import ClTypes
+from benchmarks.decoder import make_info
+from PrintfInserter import PrintfInserter
+
+
+# The per-element code generate_printf used to emit; kept here as the reference point
+def legacy_generate_printf(name: str, var_type: str, var_shape: [int]) -> str:
+    counters = ['_losev_i', '_losev_j', '_losev_k']
+    pointer_flag = ClTypes.get_printf_flag(ClTypes.pointer_type)
+
+    def array(expr, shape, depth):
+        counter = counters[depth]
+        if len(shape) == 1:
+            contents = ['printf(" ");', f'printf("{ClTypes.get_printf_flag(var_type)}", {expr}[{counter}]);']
+        else:
+            contents = [f'printf(" {pointer_flag}", {expr}[{counter}]);'] + array(f'{expr}[{counter}]', shape[1:],
+                                                                                depth + 1)
+        return [f'{counter} = 0;', f'while ({counter} < {shape[0]}) {{'] + contents + [f'{counter}++;', '}']
+
+    return '\n'.join([f'printf("{pointer_flag}", {name});'] + array(name, var_shape, 0) + ['printf("\\n");'])
+
+
+# Device printf buffers typically store a small header per call followed by the arguments
+CALL_HEADER_SIZE = 8
+COMPONENT_SIZES = {'hh': 1, 'h': 2, 'hl': 4, 'l': 8}
+
+
+def get_argument_size(spec: str) -> int:
+    match = re.fullmatch('%(?:0[0-9]+)?(?:v([0-9]+))?(hh|hl|h|l)?[a-z]', spec)
+    if match.group(1):
+        return int(match.group(1)) * COMPONENT_SIZES[match.group(2)]
+    return 8 if match.group(2) == 'l' else 4  # Scalars are promoted to int
+
+
+def count_printf(code: str) -> (int, int):
+    # Counts the printf calls and the buffer bytes of the straight-line code with while loops generate_printf emits
+    lines = [e.strip() for e in code.split('\n') if e.strip()]
+
+    def run(i: int) -> (int, int, int):
+        calls, size = 0, 0
+        while i < len(lines) and lines[i] != '}':
+            line = lines[i]
+            loop = re.fullmatch(r'while \((\w+) < ([0-9]+)\) \{', line)
+            if loop:
+                body_calls, body_size, i = run(i + 1)
+                increment = re.fullmatch(rf'{loop.group(1)} \+= ([0-9]+);', lines[i - 2])
+                iterations = -(-int(loop.group(2)) // int(increment.group(1) if increment else 1))
+                calls += body_calls * iterations
+                size += body_size * iterations
+            elif 'printf(' in line:
+                fmt = re.search(r'printf\("([^"]*)"', line).group(1)
+                calls += 1
+                size += CALL_HEADER_SIZE + sum(get_argument_size(s) for s in re.findall(r'%[a-z0-9]+', fmt))
+            i += 1
+        return calls, size, i + 1
+
+    calls, size, _ = run(0)
+    return calls, size
+
+
+def main(argv: [str]):
+    chunk_size = int(argv[0]) if argv else 16
+    inserter = PrintfInserter([], [], chunk_size=chunk_size)
+    cases = [('int', [16]), ('float', [256]), ('float4', [64]), ('int', [16, 16]), ('char', [8, 8, 8]),
+             ('double', [4, 8, 100])]
+    print(f'{"variable":<20} {"calls":>8} {"coalesced":>10} {"bytes":>8} {"coalesced":>10}')
+    for var_type, var_shape in cases:
+        legacy_calls, legacy_size = count_printf(legacy_generate_printf('v', var_type, var_shape))
+        calls, size = count_printf(inserter.generate_printf(make_info(var_type, var_shape)))
+        name = var_type + ''.join(f'[{n}]' for n in var_shape)
+        print(f'{name:<20} {legacy_calls:>8} {calls:>10} {legacy_size:>8} {size:>10}')
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -1,21 +1,26 @@
+import binascii
 import json
 import re
+from itertools import groupby
+from math import prod
+from typing import Union
 
 import numpy as np
-from clang.cindex import Cursor, CursorKind
+from clang.cindex import Cursor, CursorKind, Type, TypeKind
+
+import profiling
 
 
 class ClTypes:
-    # TODO: add half types
     pointer_type = 'uint'
     signed_integer_types = ['char', 'short', 'int', 'long']
     unsigned_integer_types = ['uchar', 'ushort', 'uint', 'ulong']
     integer_types = signed_integer_types + unsigned_integer_types
-    float_types = ['float', 'double']
+    float_types = ['half', 'float', 'double']
     vector_len = [2, 4, 8, 16]
     vector_base = float_types + integer_types
     vector_types = [f'{t}{n}' for t in vector_base for n in [2, 4, 8, 16]]
-    scalar_types = ['char', 'uchar', 'short', 'ushort', 'int', 'uint', 'long', 'ulong', 'float', 'double']
+    scalar_types = ['char', 'uchar', 'short', 'ushort', 'int', 'uint', 'long', 'ulong', 'half', 'float', 'double']
 
     parser = {
         'char': np.int8,
@@ -26,32 +31,152 @@ class ClTypes:
         'uint': np.uint32,
         'long': np.int64,
         'ulong': np.uint64,
+        'half': np.float16,
         'float': np.float32,
         'double': np.float64
     }
+    # Every value is printed as its bits (see get_printf_arg) in hex, as wide as its type
     flags = {
-        'char': 'x',
-        'uchar': 'x',
-        'short': 'hx',
-        'ushort': 'hx',
-        'int': 'x',
-        'uint': 'x',
-        'long': 'lx',
-        'ulong': 'lx',
-        'float': 'f',
-        'double': 'lf'
+        'char': '02hhx',
+        'uchar': '02hhx',
+        'short': '04hx',
+        'ushort': '04hx',
+        'half': '04hx',
+        'int': '08x',
+        'uint': '08x',
+        'float': '08x',
+        'long': '016lx',
+        'ulong': '016lx',
+        'double': '016lx'
+    }
+    # The unsigned integer type of the same size, which the values are reinterpreted as
+    bits_types = {
+        'char': 'uchar',
+        'uchar': 'uchar',
+        'short': 'ushort',
+        'ushort': 'ushort',
+        'half': 'ushort',
+        'int': 'uint',
+        'uint': 'uint',
+        'float': 'uint',
+        'long': 'ulong',
+        'ulong': 'ulong',
+        'double': 'ulong'
+    }
+    clang_kinds = {
+        TypeKind.CHAR_S: 'char',
+        TypeKind.SCHAR: 'char',
+        TypeKind.CHAR_U: 'uchar',
+        TypeKind.UCHAR: 'uchar',
+        TypeKind.SHORT: 'short',
+        TypeKind.USHORT: 'ushort',
+        TypeKind.INT: 'int',
+        TypeKind.UINT: 'uint',
+        TypeKind.LONG: 'long',
+        TypeKind.ULONG: 'ulong',
+        TypeKind.HALF: 'half',
+        TypeKind.FLOAT: 'float',
+        TypeKind.DOUBLE: 'double'
     }
+    # Vector conversions need a length modifier matching the size of the components
+    vector_flags = {
+        'char': '02v{}hhx',
+        'uchar': '02v{}hhx',
+        'short': '04v{}hx',
+        'ushort': '04v{}hx',
+        'half': '04v{}hx',
+        'int': '08v{}hlx',
+        'uint': '08v{}hlx',
+        'float': '08v{}hlx',
+        'long': '016v{}lx',
+        'ulong': '016v{}lx',
+        'double': '016v{}lx'
+    }
+    # Checksums of the records are the sums of their bytes modulo that, which stays the same however the bytes
+    # are grouped into words: see PrintfInserter.__printf
+    checksum_modulus = 255
+    # The code generators ask for the same few types over and over
+    _base_types: dict = {}
+    _sizes: dict = {}
+
+    @staticmethod
+    def get_base_type(var_type: str) -> str:
+        base_type = ClTypes._base_types.get(var_type)
+        if base_type is None:
+            match = re.fullmatch('([a-z]+)[0-9]*', var_type)
+            base_type = ClTypes._base_types[var_type] = match.group(1) if match else var_type
+        return base_type
+
+    @staticmethod
+    def get_vector_len(var_type: str) -> int:
+        if var_type in ClTypes.vector_types:
+            return int(re.search('[0-9]+', var_type).group(0))
+        return 1
+
+    @staticmethod
+    def get_size(var_type: str) -> int:
+        size = ClTypes._sizes.get(var_type)
+        if size is None:
+            size = np.dtype(ClTypes.parser[ClTypes.get_base_type(var_type)]).itemsize * ClTypes.get_vector_len(var_type)
+            ClTypes._sizes[var_type] = size
+        return size
+
+    @staticmethod
+    def get_sum_type(var_type: str) -> str:
+        # The type sums of the elements of the (base) type are accumulated in
+        if var_type == 'half':
+            return 'float'
+        if var_type in ClTypes.float_types:
+            return var_type
+        return 'ulong' if var_type in ClTypes.unsigned_integer_types else 'long'
+
+    @staticmethod
+    def from_clang(cl_type: Type) -> str:
+        # The name of a scalar or vector type (None if it's neither) whatever typedefs it goes by
+        cl_type = cl_type.get_canonical()
+        if cl_type.kind in [TypeKind.EXTVECTOR, TypeKind.VECTOR]:
+            base = ClTypes.from_clang(cl_type.element_type)
+            n = cl_type.element_count
+            return f'{base}{n}' if base is not None and n in ClTypes.vector_len else None
+        return ClTypes.clang_kinds.get(cl_type.kind)
 
     @staticmethod
     def get_printf_flag(var_type: str):
         if var_type in ClTypes.scalar_types:
             return f'%{ClTypes.flags[var_type]}'
         if var_type in ClTypes.vector_types:
-            n = re.search('[0-9]+', var_type).group(0)
-            base = re.search('[a-z]+', var_type).group(0)
-            return f'%v{n}{ClTypes.flags[base]}'
+            n = ClTypes.get_vector_len(var_type)
+            return '%' + ClTypes.vector_flags[ClTypes.get_base_type(var_type)].format(n)
         assert False  # Fail if it's not a primitive type
 
+    @staticmethod
+    def get_printf_arg(var_type: str, expression: str) -> str:
+        # The bits of the value, for the flag of get_printf_flag
+        base_type = ClTypes.get_base_type(var_type)
+        if base_type in ClTypes.unsigned_integer_types:
+            return expression
+        n = ClTypes.get_vector_len(var_type)
+        return f'as_{ClTypes.bits_types[base_type]}{n if n > 1 else ""}({expression})'
+
+    @staticmethod
+    def get_printed_length(var_type: str) -> int:
+        # The number of characters a value is printed in, components separated by commas
+        n = ClTypes.get_vector_len(var_type)
+        return n * 2 * ClTypes.get_size(ClTypes.get_base_type(var_type)) + n - 1
+
+    @staticmethod
+    def get_checksum_terms(var_type: str, expression: str) -> [str]:
+        # Terms adding up to the checksum of the bytes of the value: it's reinterpreted as a single unsigned
+        # integer or, if it's longer than 8 bytes, as a vector of ulongs
+        size = ClTypes.get_size(var_type)
+        modulus = ClTypes.checksum_modulus
+        if size <= 8:
+            bits = {1: 'uchar', 2: 'ushort', 4: 'uint', 8: 'ulong'}[size]
+            bits = expression if bits == var_type else f'as_{bits}({expression})'
+            return [f'{bits} % {modulus}']
+        n = size // 8
+        return [f'as_ulong{n}({expression}).s{k:x} % {modulus}' for k in range(n)]
+
 
 class VarInfo(object):
     _address_space_modifiers: [str] = ['__private', '__local', '__global']
@@ -62,9 +187,27 @@ class VarInfo(object):
     is_array: bool
     var_shape: []
     pointer_rank: int
+    # Arrays captured in the summary mode are printed as a Summary rather than element-wise
+    summary: bool = False
+    # What's watched (see Watch) if it's not the whole variable: var_shape and var_type are then the ones of
+    # the slice, slices keep an index or [start, stop, step] for every declared dimension
+    watch: str = None
+    slices: list = None
+    components: str = None
+    # [offset of the first index, step] in bytes of every printed dimension of an array, see ValueDecoder
+    dimension_offsets: list = None
+    # Snapshots of __global buffers (see Snapshot) keep [start, stop, step] and, for structs, the description
+    # of the NumPy dtype and the [path, var_type] of every scalar or vector field
+    snapshot: list = None
+    fields: dict = None
+    leaves: list = None
+    # The Trace of the breakpoint, if any: the records then carry the hit (iteration) they were printed at
+    trace: str = None
+    # The number of launches (see PrintfInserter's max_launches) the records carry the launch of, if counted
+    launches: int = None
 
     def __init__(self, node: Cursor):
-        assert node.kind == CursorKind.VAR_DECL
+        assert node.kind in [CursorKind.VAR_DECL, CursorKind.PARM_DECL]
 
         self.var_name = node.spelling
 
@@ -91,6 +234,19 @@ class VarInfo(object):
         match = re.findall('\*', self.full_type)
         self.pointer_rank = len(match)
 
+    def get_declared_shape(self) -> [int]:
+        # var_shape and var_type may be the ones of a watched slice, full_type is always the declared one
+        return [int(n) for n in re.findall(r'\[([0-9]+)\]', self.full_type)]
+
+    def get_declared_type(self) -> str:
+        return self.full_type.split(' ')[1]
+
+    @staticmethod
+    def from_dict(d: dict) -> 'VarInfo':
+        info = VarInfo.__new__(VarInfo)
+        info.__dict__.update(d)
+        return info
+
     def __str__(self):
         return json.dumps(self, default=lambda o: o.__dict__)
 
@@ -98,76 +254,297 @@ class VarInfo(object):
         return str(self)
 
 
+class ValueDecoder(object):
+    # Decodes the printf output of a variable in one vectorized pass. A record is the line printed for
+    # a single thread: the address of an array followed by its flattened elements, see PrintfInserter.generate_printf.
+    # The values are printed as their bits in fixed-width hex, so the records of a variable are all of the same
+    # length and their bytes are only reinterpreted
+    _decoders: dict = {}
+
+    def __init__(self, info: VarInfo):
+        self.is_array = info.is_array
+        self.var_shape = tuple(info.var_shape) if info.is_array else ()
+        self.var_type = ClTypes.pointer_type if info.pointer_rank and not info.is_array else info.var_type
+        self.base_type = ClTypes.get_base_type(self.var_type)
+        self.supported = self.base_type in ClTypes.scalar_types
+        self.n_components = ClTypes.get_vector_len(self.var_type) if self.supported else 0
+
+        self.n_pointers = 1 if self.is_array else 0
+        self.n_values = prod(self.var_shape) * self.n_components
+        self.value_shape = self.var_shape + ((self.n_components,) if self.var_type in ClTypes.vector_types else ())
+        self._header_offsets = self.__get_header_offsets(info) if self.is_array and self.supported else None
+
+    @staticmethod
+    def for_info(info: VarInfo) -> 'ValueDecoder':
+        offsets = tuple(map(tuple, info.dimension_offsets)) if info.dimension_offsets is not None else None
+        key = (info.var_type, tuple(info.var_shape) if info.is_array else None, info.pointer_rank, offsets)
+        decoder = ValueDecoder._decoders.get(key)
+        if decoder is None:
+            decoder = ValueDecoder(info)
+            ValueDecoder._decoders[key] = decoder
+        return decoder
+
+    def __get_header_offsets(self, info: VarInfo) -> np.ndarray:
+        # The offsets of the array and of all its sub-arrays in the order they used to be printed in: every
+        # sub-array right before its own sub-arrays
+        offsets = info.dimension_offsets
+        if offsets is None:
+            # A whole array
+            size = ClTypes.get_size(self.var_type)
+            offsets = [[0, prod(self.var_shape[d + 1:]) * size] for d in range(len(self.var_shape))]
+        headers = []
+
+        def walk(offset: int, d: int):
+            headers.append(offset)
+            if d < len(self.var_shape) - 1:
+                first, step = offsets[d]
+                for i in range(self.var_shape[d]):
+                    walk(offset + first + i * step, d + 1)
+
+        walk(0, 0)
+        return np.array(headers, dtype=np.uint64)
+
+    def get_headers(self, address: int) -> [int]:
+        # The addresses of the array and its sub-arrays, which wrap around as the printed (32-bit) ones do
+        return (self._header_offsets + np.uint64(address)).astype(np.uint32).tolist()
+
+    @staticmethod
+    def to_bytes(records, size: int) -> np.ndarray:
+        # The bytes of the values of every record (big-endian, as the digits are printed), of shape
+        # (n_records, size). The records may be str or, as they come from the binary, bytes
+        if records and isinstance(records[0], str):
+            records = [r.encode('ascii') for r in records]
+        digits = b''.join(records).replace(b' ', b'').replace(b',', b'')
+        if len(digits) != 2 * size * len(records):
+            raise Exception(f'Expected {size} bytes per record, got {len(digits) / 2 / max(len(records), 1)}')
+        return np.frombuffer(binascii.a2b_hex(digits), dtype=np.uint8).reshape(len(records), size)
+
+    @staticmethod
+    def view(data: np.ndarray, var_type: str) -> np.ndarray:
+        # Reinterprets the bytes along the last axis as values of the (scalar) type, in the native byte order
+        dtype = np.dtype(ClTypes.parser[var_type])
+        data = np.ascontiguousarray(data)
+        return data.view(dtype.newbyteorder('>')).astype(dtype)
+
+    def decode(self, records) -> (np.ndarray, np.ndarray):
+        # Returns the headers of shape (n_records, n_pointers) and the values of shape (n_records, *value_shape)
+        assert self.supported
+        pointer_size = self.n_pointers * ClTypes.get_size(ClTypes.pointer_type)
+        data = self.to_bytes(records, pointer_size + self.n_values * ClTypes.get_size(self.base_type))
+        pointers = self.view(data[:, :pointer_size], ClTypes.pointer_type)
+        values = self.view(data[:, pointer_size:], self.base_type)
+        profiling.count('decoder.values', values.size)
+        return pointers, values.reshape((len(records),) + self.value_shape)
+
+
+class Summary(object):
+    # Statistics of an array reduced on the device, see PrintfInserter.generate_summary. The non-finite elements
+    # only go to the counts
+    n_tokens = 8
+
+    def __init__(self, address: int, minimum, maximum, total, count: int, nan_count: int, inf_count: int,
+                 first_non_finite: int):
+        self.address = address
+        self.count = count
+        self.min = minimum if count else None
+        self.max = maximum if count else None
+        self.sum = total
+        self.mean = total / count if count else None
+        self.nan_count = nan_count
+        self.inf_count = inf_count
+        self.first_non_finite = first_non_finite if first_non_finite >= 0 else None
+
+    fields = ['address', 'min', 'max', 'sum', 'count', 'nan_count', 'inf_count', 'first_non_finite']
+
+    @staticmethod
+    def get_types(info: VarInfo) -> [str]:
+        base_type = ClTypes.get_base_type(info.var_type)
+        return [ClTypes.pointer_type, base_type, base_type, ClTypes.get_sum_type(base_type)] + ['int'] * 4
+
+    @staticmethod
+    def decode_columns(info: VarInfo, records) -> [np.ndarray]:
+        # Records are '<address> <min> <max> <sum> <count> <NaN count> <Inf count> <first non-finite index>'
+        types = Summary.get_types(info)
+        offsets = np.cumsum([0] + [ClTypes.get_size(t) for t in types])
+        data = ValueDecoder.to_bytes(records, int(offsets[-1]))
+        columns = [ValueDecoder.view(data[:, a:b], t)[:, 0] for a, b, t in zip(offsets, offsets[1:], types)]
+        profiling.count('decoder.values', len(records) * Summary.n_tokens)
+        return columns
+
+    @staticmethod
+    def decode_all(info: VarInfo, records) -> ['Summary']:
+        columns = [c.tolist() for c in Summary.decode_columns(info, records)]
+        return [Summary(*row) for row in zip(*columns)]
+
+
+class Buffer(object):
+    # Snapshots of a __global buffer, see PrintfInserter.generate_snapshot. Buffers of structs are decoded into
+    # structured arrays with the layout of the struct, the fields that couldn't be printed are zeroed
+    @staticmethod
+    def get_dtype(info: VarInfo) -> np.dtype:
+        if info.fields is None:
+            return np.dtype(ClTypes.parser[ClTypes.get_base_type(info.var_type)])
+        return Buffer.__make_dtype(info.fields)
+
+    @staticmethod
+    def __make_dtype(fields: dict) -> np.dtype:
+        formats = []
+        for element, shape in fields['formats']:
+            element = Buffer.__make_dtype(element) if isinstance(element, dict) else np.dtype(element)
+            formats.append((element, tuple(shape)) if shape else element)
+        return np.dtype({'names': fields['names'], 'formats': formats, 'offsets': fields['offsets'],
+                         'itemsize': fields['itemsize']})
+
+    @staticmethod
+    def decode_all(info: VarInfo, records) -> (np.ndarray, np.ndarray):
+        # Returns the addresses of the buffers and their elements of shape (n_records, count[, n_components])
+        count = info.var_shape[0]
+        leaves = info.leaves if info.leaves is not None else [[[], info.var_type]]
+        sizes = [ClTypes.get_size(t) for _, t in leaves]
+        pointer_size = ClTypes.get_size(ClTypes.pointer_type)
+        data = ValueDecoder.to_bytes(records, pointer_size + count * sum(sizes))
+        addresses = ValueDecoder.view(data[:, :pointer_size], ClTypes.pointer_type)[:, 0]
+        data = data[:, pointer_size:].reshape(len(records), count, sum(sizes))
+        profiling.count('decoder.values', len(records) * count * sum(ClTypes.get_vector_len(t) for _, t in leaves))
+        if info.leaves is None:
+            values = ValueDecoder.view(data, ClTypes.get_base_type(info.var_type))
+            return addresses, values if info.var_type in ClTypes.vector_types else values[:, :, 0]
+
+        values = np.zeros((len(records), count), dtype=Buffer.get_dtype(info))
+        column = 0
+        for (path, var_type), size in zip(leaves, sizes):
+            target = values
+            for p in path:
+                # Array subscripts go to the first axis after (records, elements) that's left
+                target = target[p] if isinstance(p, str) else target[:, :, p]
+            leaf = ValueDecoder.view(data[:, :, column:column + size], ClTypes.get_base_type(var_type))
+            target[...] = leaf.reshape(target.shape)
+            column += size
+        return addresses, values
+
+
 class Variable(object):
-    def __init__(self, info: VarInfo, value: str, gid: int = None):
+    def __init__(self, info: VarInfo, value: Union[str, bytes], gid: int = None, as_ndarray: bool = False):
         self.info = info
         self.gid = gid
 
-        if info.is_array:
-            n_dims = len(info.var_shape)
-            values = value.split(' ')
-            if n_dims == 1:
-                self.value = self.__parse_1d_array(values, info.var_shape, info.var_type)
-            elif n_dims == 2:
-                self.value = self.__parse_2d_array(values, info.var_shape, info.var_type)
-            elif n_dims == 3:
-                self.value = self.__parse_3d_array(values, info.var_shape, info.var_type)
+        if info.summary:
+            self.value = Summary.decode_all(info, [value])[0]
+            return
+        if info.snapshot is not None:
+            addresses, values = Buffer.decode_all(info, [value])
+            self.__set_buffer(int(addresses[0]), values[0], as_ndarray)
+            return
+        decoder = ValueDecoder.for_info(info)
+        if decoder.supported:
+            pointers, values = decoder.decode([value])
+            self.__set_value(decoder, pointers[0], values[0], as_ndarray)
         else:
-            self.value = self.__parse_value(value, info.var_type)
+            self.value = None  # TODO: implement structs parsing
 
     @staticmethod
-    def __parse_scalar_value(value, var_type):
-        if var_type not in ClTypes.float_types:
-            value = int(value, base=16)
-            return int(ClTypes.parser[var_type](value))
-        return float(ClTypes.parser[var_type](value))
+    def decode_all(info: VarInfo, values: [Union[str, bytes]], gids: [int], as_ndarray: bool = False,
+                   hits: [int] = None, launches: [int] = None) -> ['Variable']:
+        # The hits of a traced breakpoint (see Trace) the values were printed at go to Variable.hit, the launches
+        # (if they're counted, see VarInfo.launches) to Variable.launch
+        assert len(values) == len(gids)
+        variables = Variable.__decode_all(info, values, gids, as_ndarray)
+        if hits is not None:
+            for variable, hit in zip(variables, hits):
+                variable.hit = hit
+        if launches is not None:
+            for variable, launch in zip(variables, launches):
+                variable.launch = launch
+        return variables
 
     @staticmethod
-    def __parse_vector_value(value, var_type):
-        elements = value.split(',')
-        assert len(elements) in [2, 4, 8, 16]
-        base = re.search('[a-z]+', var_type).group(0)
-        return [Variable.__parse_scalar_value(value=e, var_type=base) for e in elements]
+    def decode_series(info: VarInfo, values: [Union[str, bytes]], gids: [int], hits: [int],
+                      as_ndarray: bool = False, launches: [int] = None) -> ['Variable']:
+        # A Variable per thread (and launch, if they're counted) with the values of all its hits of a traced
+        # breakpoint in Variable.hits order: an ndarray with the hits along the first axis (and the addresses of
+        # arrays in Variable.address) or a list of them
+        launches = launches if launches is not None else [None] * len(gids)
+        order = sorted(range(len(gids)), key=lambda i: (gids[i], launches[i] or 0, hits[i]))
+        decoded = Variable.__decode_all(info, [values[i] for i in order], [gids[i] for i in order], as_ndarray)
+        series = []
+        for (gid, launch), group in groupby(zip(decoded, [hits[i] for i in order], [launches[i] for i in order]),
+                                            key=lambda e: (e[0].gid, e[2])):
+            group = [(v, hit) for v, hit, _ in group]
+            variable = Variable.__make(info, gid)
+            if launch is not None:
+                variable.launch = launch
+            variable.hits = [hit for _, hit in group]
+            if as_ndarray and all(isinstance(v.value, (np.ndarray, np.generic)) for v, _ in group):
+                variable.value = np.stack([v.value for v, _ in group])
+                if hasattr(group[0][0], 'address'):
+                    variable.address = np.array([v.address for v, _ in group], dtype=np.uint64)
+            else:
+                variable.value = [v.value for v, _ in group]
+            series.append(variable)
+        return series
 
     @staticmethod
-    def __parse_value(value, var_type):
-        if var_type in ClTypes.scalar_types:
-            return Variable.__parse_scalar_value(value=value, var_type=var_type)
-        elif var_type in ClTypes.vector_types:
-            return Variable.__parse_vector_value(value=value, var_type=var_type)
-        else:
-            pass  # TODO: implement structs parsing
+    def __decode_all(info: VarInfo, values: [Union[str, bytes]], gids: [int], as_ndarray: bool) -> ['Variable']:
+        if info.summary:
+            variables = [Variable.__make(info, gid) for gid in gids]
+            for variable, summary in zip(variables, Summary.decode_all(info, values) if values else []):
+                variable.value = summary
+            return variables
+        if info.snapshot is not None:
+            variables = [Variable.__make(info, gid) for gid in gids]
+            for variable, address, value in zip(variables, *(Buffer.decode_all(info, values) if values else [])):
+                variable.__set_buffer(int(address), value, as_ndarray)
+            return variables
+        decoder = ValueDecoder.for_info(info)
+        if not decoder.supported or not values:
+            return [Variable(info, v, gid, as_ndarray) for v, gid in zip(values, gids)]
+        pointers, decoded = decoder.decode(values)
+        variables = []
+        for i, gid in enumerate(gids):
+            variable = Variable.__make(info, gid)
+            variable.__set_value(decoder, pointers[i], decoded[i], as_ndarray)
+            variables.append(variable)
+        return variables
 
     @staticmethod
-    def __parse_1d_array(arr: [str], var_shape: [int], var_type: str):
-        assert len(arr) == 1 + var_shape[0]
-        return [Variable.__parse_value(arr[0], ClTypes.pointer_type), [Variable.__parse_value(v, var_type) for v in arr[1:]]]
+    def __make(info: VarInfo, gid: int) -> 'Variable':
+        variable = Variable.__new__(Variable)
+        variable.info = info
+        variable.gid = gid
+        return variable
 
-    @staticmethod
-    def __parse_2d_array(arr: [str], var_shape: [int], var_type: str):
-        assert len(arr) == 1 + var_shape[0] * (1 + var_shape[1])
-        retval = [Variable.__parse_value(arr[0], ClTypes.pointer_type)]
-        for i in range(var_shape[0]):
-            array_1d = arr[1 + (i + 0) * (1 + var_shape[1]): 1 + (i + 1) * (1 + var_shape[1])]
-            retval.append(Variable.__parse_1d_array(array_1d, (var_shape[1],), var_type))
-        return retval
+    def __set_value(self, decoder: ValueDecoder, pointers: np.ndarray, value: np.ndarray, as_ndarray: bool):
+        if as_ndarray:
+            if self.info.is_array:
+                self.address = int(pointers[0])
+            self.value = value
+        elif self.info.is_array:
+            self.value = self.__nest(iter(decoder.get_headers(int(pointers[0]))), value, len(self.info.var_shape))
+        else:
+            self.value = value.tolist()
+
+    def __set_buffer(self, address: int, value: np.ndarray, as_ndarray: bool):
+        if as_ndarray:
+            self.address = address
+            self.value = value
+        else:
+            self.value = [address, value.tolist()]
 
     @staticmethod
-    def __parse_3d_array(arr: [str], var_shape: [int], var_type: str):
-        assert len(arr) == 1 + var_shape[0] * (1 + var_shape[1] * (1 + var_shape[2]))
-        retval = [Variable.__parse_value(arr[0], ClTypes.pointer_type)]
-        for i in range(var_shape[0]):
-            array_2d = arr[1 + (i + 0) * (1 + var_shape[1] * (1 + var_shape[2])):
-                           1 + (i + 1) * (1 + var_shape[1] * (1 + var_shape[2]))]
-            retval.append(Variable.__parse_2d_array(array_2d, (var_shape[1], var_shape[2]), var_type))
-        return retval
+    def __nest(pointers, value: np.ndarray, n_dims: int):
+        # Restores the [pointer, [...]] structure of the printed arrays
+        if n_dims == 1:
+            return [next(pointers), value.tolist()]
+        return [next(pointers)] + [Variable.__nest(pointers, v, n_dims - 1) for v in value]
 
     def __str__(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return json.dumps(self, default=lambda o: o.tolist() if isinstance(o, (np.ndarray, np.generic)) else o.__dict__)
 
     def __repr__(self):
         return str(self)
 
 
 if __name__ == '__main__':
-    print(Variable.parse_value(value='0.100000,0.200000', var_type='double2'))
+    info = VarInfo.from_dict({'var_name': 'v', 'full_type': '__private double2', 'address_space': '__private',
+                              'var_type': 'double2', 'is_array': False, 'pointer_rank': 0})
+    print(Variable(info, '3fb999999999999a,3fc999999999999a'))
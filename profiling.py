@@ -0,0 +1,93 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+
+# The pipeline reports its phases and counters to the active profiler. Nothing is active by default, so that
+# profiling costs a global lookup and a call per phase or counter when disabled
+_profiler = None
+_disabled = nullcontext()
+
+
+class Profiler(object):
+    def __init__(self):
+        # name: [calls, seconds]
+        self.phases: Dict[str, List] = {}
+        self.counters: Dict[str, int] = {}
+        self._hooks: List[Callable[[str, float], None]] = []
+
+    def add_hook(self, hook: Callable[[str, float], None]):
+        # The hook is called with the name and the duration of every phase once it's over
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[str, float], None]):
+        self._hooks.remove(hook)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stats = self.phases.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            for hook in self._hooks:
+                hook(name, seconds)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        return {
+            'phases': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.phases.items()},
+            'counters': dict(self.counters)
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+    def to_table(self) -> str:
+        # Phases nest, e.g. source.* run within debugger.instrument, so their times don't add up
+        width = max([len(name) for name in list(self.phases) + list(self.counters)] + [len('phase')])
+        lines = [f'{"phase":<{width}} {"calls":>7} {"total, s":>10} {"mean, ms":>10}']
+        for name, (calls, seconds) in self.phases.items():
+            lines.append(f'{name:<{width}} {calls:>7} {seconds:>10.4f} {seconds / calls * 1000:>10.3f}')
+        if self.counters:
+            lines.append('')
+            lines.append(f'{"counter":<{width}} {"value":>7}')
+            lines.extend(f'{name:<{width}} {value:>7}' for name, value in self.counters.items())
+        return '\n'.join(lines)
+
+
+def enable(profiler: Profiler = None) -> Profiler:
+    global _profiler
+    _profiler = profiler or Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+
+def add_hook(hook: Callable[[str, float], None]):
+    if _profiler is None:
+        raise Exception('Profiling is disabled')
+    _profiler.add_hook(hook)
+
+
+def phase(name: str):
+    if _profiler is None:
+        return _disabled
+    return _profiler.phase(name)
+
+
+def count(name: str, n: int = 1):
+    if _profiler is not None:
+        _profiler.count(name, n)